@@ -0,0 +1,274 @@
+import os
+import json
+import hashlib
+import subprocess
+import numpy as np
+from pydub import AudioSegment
+
+# Directory of the decoded-audio cache, or None to decode every time; change with configure_cache.
+# Resolved from this file so every script shares one cache whatever the working directory.
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "output", "audio_cache")
+
+# Size limit of the cache; the least recently used recordings are evicted beyond it
+max_cache_bytes = 10 * 2 ** 30
+
+# Running total of the cache's .npy bytes, or None until the directory is first scanned.
+# Only this process's writes are added, so other processes' writes are picked up at the next eviction.
+_cache_bytes = None
+
+# NumPy dtype of each pydub sample width (pydub stores 8-bit audio signed and 24-bit audio as 32-bit)
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+def configure_cache(directory, max_bytes=None):
+    """
+    Set where decoded audio is cached.
+    Args:
+        directory (str): Cache directory, or None to disable the cache.
+        max_bytes (int): Size limit of the cache in bytes. Defaults to the current limit.
+    """
+    global cache_dir, max_cache_bytes, _cache_bytes
+    cache_dir = directory
+    _cache_bytes = None
+    if max_bytes is not None:
+        max_cache_bytes = max_bytes
+
+
+def source_digest(path):
+    """
+    Compute the SHA-256 hash of a file's content, which keys its cache entries.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_entry(key):
+    """
+    Memory-map a cached array and mark it as recently used.
+    Returns:
+        tuple: The array and its metadata dict, or None if the entry is not cached.
+    """
+    array_path = os.path.join(cache_dir, f"{key}.npy")
+    try:
+        array = np.load(array_path, mmap_mode="r")
+        with open(os.path.join(cache_dir, f"{key}.json"), 'r') as json_file:
+            metadata = json.load(json_file)
+        os.utime(array_path)
+    except (OSError, ValueError):
+        return None
+    return array, metadata
+
+
+def _cache_entries():
+    """
+    List the cached arrays.
+    Returns:
+        list: (modification time, size, path) of every .npy file in the cache directory.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".npy"):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def _store_entry(key, array, metadata):
+    """
+    Write an array and its metadata to the cache, then evict old entries beyond the size limit.
+    The array is renamed into place last, so a present .npy file always has its metadata.
+    The cache directory is only scanned once and whenever the running size exceeds the limit.
+    """
+    global _cache_bytes
+    os.makedirs(cache_dir, exist_ok=True)
+    if _cache_bytes is None:
+        _cache_bytes = sum(size for _, size, _ in _cache_entries())
+    array_path = os.path.join(cache_dir, f"{key}.npy")
+    json_path = os.path.join(cache_dir, f"{key}.json")
+    temp_path = f"{array_path}.{os.getpid()}.tmp"
+    try:
+        with open(json_path, 'w') as json_file:
+            json.dump(metadata, json_file)
+        with open(temp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(temp_path, array_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        if not os.path.exists(array_path) and os.path.exists(json_path):
+            os.remove(json_path)
+    _cache_bytes += os.path.getsize(array_path)
+    if _cache_bytes > max_cache_bytes:
+        _cache_bytes = evict(max_cache_bytes, keep=array_path)
+
+
+def evict(max_bytes, keep=None):
+    """
+    Remove the least recently used cache entries until the cache fits in max_bytes.
+    Args:
+        max_bytes (int): Size limit in bytes.
+        keep (str): Path of an entry that must not be removed.
+    Returns:
+        int: Size of the remaining entries in bytes.
+    """
+    entries = _cache_entries()
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            os.remove(path[:-len(".npy")] + ".json")
+        except OSError:
+            continue
+        total -= size
+    return total
+
+
+def segment_samples(audio):
+    """
+    View the samples of an AudioSegment as an array of shape (frames, channels) without copying.
+    Unlike get_array_of_samples, this also works for segments backed by a cached buffer.
+    """
+    return np.frombuffer(audio.raw_data, dtype=SAMPLE_DTYPES[audio.sample_width]).reshape(-1, audio.channels)
+
+
+def load_segment(path):
+    """
+    Decode an audio file at its native sampling rate, channels and sample width, through the cache.
+    Args:
+        path (str): Path to the audio file.
+    Returns:
+        AudioSegment: Decoded audio. When it comes from the cache, its samples are a
+                      read-only memory map shared with other processes reading the same file.
+    """
+    if cache_dir is None:
+        return AudioSegment.from_file(path)
+
+    key = f"{source_digest(path)}-native"
+    entry = _load_entry(key)
+    if entry is None:
+        audio = AudioSegment.from_file(path)
+        samples = segment_samples(audio)
+        try:
+            _store_entry(key, samples, {"frame_rate": audio.frame_rate, "channels": audio.channels,
+                                        "sample_width": audio.sample_width, "source": os.path.abspath(path)})
+        except OSError as e:
+            # A full or read-only cache only costs the next decode
+            print(f"Could not cache the decoded audio of {path}: {e}")
+        return audio
+
+    samples, metadata = entry
+    return AudioSegment(data=memoryview(samples).cast("B"), sample_width=metadata["sample_width"],
+                        frame_rate=metadata["frame_rate"], channels=metadata["channels"])
+
+
+def decode_pcm(path, sample_rate):
+    """
+    Decode an audio file to mono 16-bit PCM at a given sampling rate with ffmpeg,
+    using the same command as whisper.load_audio.
+    """
+    command = ["ffmpeg", "-nostdin", "-threads", "0", "-i", path, "-f", "s16le", "-ac", "1",
+               "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-"]
+    result = subprocess.run(command, capture_output=True, check=True)
+    return np.frombuffer(result.stdout, np.int16)
+
+
+def iter_pcm_windows(path, sample_rate, window_samples, hop_samples):
+    """
+    Decode an audio file to mono 16-bit PCM in overlapping windows, without holding the whole signal.
+    Cached PCM is sliced from its memory map; otherwise ffmpeg's output is read as it is decoded,
+    so the first window is available long before the file is fully decoded.
+    Args:
+        path (str): Path to the audio file.
+        sample_rate (int): Target sampling rate in Hz.
+        window_samples (int): Length of each window in samples.
+        hop_samples (int): Distance between the starts of consecutive windows in samples.
+    Returns:
+        generator: Yields (first sample index, int16 np.ndarray) tuples. The last window may be shorter,
+                   and a window is only yielded if it holds samples not covered by the previous one.
+    """
+    overlap = window_samples - hop_samples
+    entry = _load_entry(f"{source_digest(path)}-{sample_rate}hz-mono") if cache_dir is not None else None
+    if entry is not None:
+        pcm = entry[0]
+        first = 0
+        while len(pcm) > (first + overlap if first else 0):
+            yield first, pcm[first:first + window_samples]
+            first += hop_samples
+        return
+
+    command = ["ffmpeg", "-nostdin", "-threads", "0", "-i", path, "-f", "s16le", "-ac", "1",
+               "-acodec", "pcm_s16le", "-ar", str(sample_rate), "-"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        buffer = np.empty(0, np.int16)
+        first = 0
+        end_of_stream = False
+        while True:
+            # Read until the window is full or the stream ends
+            while len(buffer) < window_samples and not end_of_stream:
+                data = process.stdout.read((window_samples - len(buffer)) * 2)
+                if not data:
+                    end_of_stream = True
+                else:
+                    buffer = np.concatenate([buffer, np.frombuffer(data, np.int16)])
+            if len(buffer) == window_samples or len(buffer) > (overlap if first else 0):
+                yield first, buffer[:window_samples]
+            if end_of_stream:
+                break
+            buffer = buffer[hop_samples:]
+            first += hop_samples
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+
+def load_pcm(path, sample_rate):
+    """
+    Decode an audio file to mono 16-bit PCM at a given sampling rate, through the cache.
+    Args:
+        path (str): Path to the audio file.
+        sample_rate (int): Target sampling rate in Hz.
+    Returns:
+        np.ndarray: int16 samples, memory-mapped when they come from the cache.
+    """
+    if cache_dir is None:
+        return decode_pcm(path, sample_rate)
+
+    key = f"{source_digest(path)}-{sample_rate}hz-mono"
+    entry = _load_entry(key)
+    if entry is not None:
+        return entry[0]
+    pcm = decode_pcm(path, sample_rate)
+    try:
+        _store_entry(key, pcm, {"frame_rate": sample_rate, "channels": 1, "sample_width": 2,
+                                "source": os.path.abspath(path)})
+    except OSError as e:
+        print(f"Could not cache the decoded audio of {path}: {e}")
+    return pcm
+
+
+def load_whisper_audio(path, sample_rate=16000):
+    """
+    Load audio for Whisper through the cache; equivalent to whisper.load_audio.
+    Args:
+        path (str): Path to the video/audio file.
+        sample_rate (int): Sampling rate in Hz expected by the model.
+    Returns:
+        np.ndarray: Mono float32 signal in the range [-1, 1].
+    """
+    return load_pcm(path, sample_rate).astype(np.float32) / 32768.0
@@ -1,37 +1,195 @@
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 from pydub import AudioSegment
 from tqdm import tqdm
+from audio_cache import load_segment
+from instrumentation import file_size, track
+from timestamps import index_timestamps, parse_timestamps
+
+# Extensions of the source recordings, in order of preference; .flac and .wav are the
+# lossless outputs of convert_m4a_to_mp3
+source_extensions = ('.mp3', '.flac', '.wav')
+
+def find_source_file(input_dir, base_filename):
+    """
+    Find the source recording of a file listed in the CSV.
+    Args:
+        input_dir (str): Directory containing input audio files.
+        base_filename (str): Base filename from the CSV's 'File' column.
+    Returns:
+        str: Path to the first existing file among source_extensions, or the .mp3 path if there is none.
+    """
+    for ext in source_extensions:
+        possible_path = os.path.join(input_dir, base_filename + ext)
+        if os.path.isfile(possible_path):
+            return possible_path
+    return os.path.join(input_dir, base_filename + source_extensions[0])
+
+def load_audio(input_file):
+    """
+    Decode an audio file once into a PCM buffer, reusing the decoded-audio cache when possible.
+    Args:
+        input_file (str): Path to the input audio file.
+    Returns:
+        AudioSegment: Decoded audio that clips can be cut from.
+    """
+    return load_segment(input_file)
+
+def cut_clip(audio, start_time, end_time, padding=0.1):
+    """
+    Cut a padded clip out of a decoded audio buffer without copying the PCM data.
+    Args:
+        audio (AudioSegment): Decoded source audio.
+        start_time (float): Start time in seconds.
+        end_time (float): End time in seconds.
+        padding (float): Padding to add on each side of the clip in seconds.
+    Returns:
+        AudioSegment: Clip whose samples are a view into the source buffer.
+    """
+    duration = len(audio) / 1000.0  # Get the total duration of the audio in seconds
+
+    # Ensure padding does not exceed the audio duration
+    adjusted_start = max(0, start_time - padding)
+    adjusted_end = min(duration, end_time + padding)
+
+    # Convert to frame offsets the same way pydub's millisecond slicing does
+    total_frames = int(audio.frame_count())
+    start_frame = min(int(audio.frame_count(ms=adjusted_start * 1000)), total_frames)
+    end_frame = max(start_frame, min(int(audio.frame_count(ms=adjusted_end * 1000)), total_frames))
+
+    # Slice the raw PCM through a memoryview so the clip shares the source buffer
+    pcm = memoryview(audio.raw_data)[start_frame * audio.frame_width:end_frame * audio.frame_width]
+    return AudioSegment(data=pcm, sample_width=audio.sample_width,
+                        frame_rate=audio.frame_rate, channels=audio.channels)
 
 def splice_audio(input_file, output_file, start_time, end_time):
     """
     Splice an audio file from start_time to end_time.
     Args:
-        input_file (str): Path to the input audio file.
+        input_file (str or AudioSegment): Path to the input audio file, or audio already decoded with load_audio.
         output_file (str): Path to save the spliced audio.
         start_time (float): Start time in seconds.
         end_time (float): End time in seconds.
     """
     try:
-        audio = AudioSegment.from_file(input_file)
-        duration = len(audio) / 1000.0  # Get the total duration of the audio in seconds
-        
-        # Ensure padding does not exceed the audio duration
-        adjusted_start = max(0, start_time - 0.1)
-        adjusted_end = min(duration, end_time + 0.1)
-        
-        spliced_audio = audio[adjusted_start * 1000:adjusted_end * 1000]  # Convert to milliseconds
-        spliced_audio.export(output_file, format="mp3")
+        with track("splice_audio", output_file) as item:
+            if isinstance(input_file, AudioSegment):
+                audio = input_file
+            else:
+                with item.phase("decode"):
+                    audio = load_audio(input_file)
+                item.add_bytes(read=file_size(input_file))
+            with item.phase("cut"):
+                spliced_audio = cut_clip(audio, start_time, end_time)
+            with item.phase("encode"):
+                spliced_audio.export(output_file, format="mp3")
+            item.add_bytes(written=file_size(output_file))
     except Exception as e:
         print(f"Error processing {output_file}: {e}")
 
-def process_audio_clips(input_dir, output_dir, csv_file):
+def collect_clip_ranges(data, with_labels=False):
+    """
+    Gather the timestamp ranges of every file listed in the CSV.
+    Args:
+        data (pd.DataFrame): Timestamp table with a 'File' column followed by "start:end" columns.
+        with_labels (bool): Whether to keep the column label of each range.
+    Returns:
+        tuple: A dict mapping each base filename to a list of (start, end) tuples in CSV order,
+               or (label, start, end) tuples with with_labels, and a list of error records for
+               cells that could not be parsed.
+    """
+    table, invalid = parse_timestamps(data)
+    ranges = index_timestamps(table)
+    if not with_labels:
+        ranges = {base_filename: [(start, end) for _, start, end in file_ranges]
+                  for base_filename, file_ranges in ranges.items()}
+    errors = [
+        _error_record(cell["file"], None, None, None,
+                      f"Invalid timestamp format in column {cell['label']}: {cell['value']}")
+        for cell in invalid
+    ]
+    return ranges, errors
+
+def clip_filename(base_filename, start_time, end_time, label=None):
+    """
+    Build the file name of one clip, prefixed with its keyword label if given.
+    """
+    name = f"{base_filename}_{start_time:.3f}-{end_time:.3f}.mp3"
+    return f"{label}_{name}" if label is not None else name
+
+def _error_record(base_filename, start_time, end_time, output_path, message):
+    """
+    Build one entry of the error report returned by process_audio_clips.
+    """
+    return {
+        "file": base_filename,
+        "start": start_time,
+        "end": end_time,
+        "output": output_path,
+        "error": message,
+    }
+
+def splice_file(input_path, output_dir, base_filename, ranges, labels=None):
+    """
+    Decode one source file and write a clip for each of its timestamp ranges.
+    This is the unit of work handed to each worker process.
+    Args:
+        input_path (str): Path to the source audio file.
+        output_dir (str): Directory to save output clips.
+        base_filename (str): Base filename used to name the clips.
+        ranges (list): List of (start, end) tuples in seconds.
+        labels (list): Optional keyword label of each range, used as a prefix of the clip names.
+    Returns:
+        tuple: Number of clips written and a list of error records.
+    """
+    if not os.path.exists(input_path):
+        return 0, [_error_record(base_filename, None, None, None, f"File {input_path} not found")]
+
+    with track("splice_file", input_path) as item:
+        try:
+            # Decode the source file once for all of its ranges
+            with item.phase("decode"):
+                audio = load_audio(input_path)
+            item.add_bytes(read=file_size(input_path))
+        except Exception as e:
+            return 0, [_error_record(base_filename, None, None, None, f"Error decoding {input_path}: {e}")]
+
+        written = 0
+        errors = []
+        for i, (start_time, end_time) in enumerate(ranges):
+            # Generate output filename
+            label = labels[i] if labels is not None else None
+            output_path = os.path.join(output_dir, clip_filename(base_filename, start_time, end_time, label))
+            try:
+                # Splice the audio with padding
+                with item.phase("cut"):
+                    clip = cut_clip(audio, start_time, end_time)
+                with item.phase("encode"):
+                    clip.export(output_path, format="mp3")
+                item.add_bytes(written=file_size(output_path))
+                written += 1
+            except Exception as e:
+                errors.append(_error_record(base_filename, start_time, end_time, output_path, str(e)))
+
+        # Release the decoded buffer before the worker moves on to the next file
+        del audio
+    return written, errors
+
+def process_audio_clips(input_dir, output_dir, csv_file, workers=1, label_names=False):
     """
     Process audio files based on timestamp ranges in the CSV file.
+    Each source file is decoded once and all of its clips are cut from that buffer.
     Args:
         input_dir (str): Directory containing input audio files.
         output_dir (str): Directory to save output clips.
         csv_file (str): Path to the CSV file with filenames and timestamp ranges.
+        workers (int): Number of worker processes. Each worker handles one file and all of its ranges at a time.
+        label_names (bool): Prefix each clip name with the CSV column label of its range, so the
+                            spectrogram generator files it under that keyword.
+    Returns:
+        dict: Report with the number of files and clips processed and a list of error records,
+              or None if the CSV file is invalid.
     """
     # Load the CSV file
     data = pd.read_csv(csv_file)
@@ -41,28 +199,31 @@ def process_audio_clips(input_dir, output_dir, csv_file):
     
     # Create the output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
-    
-    # Process each row in the CSV
-    for _, row in tqdm(data.iterrows(), total=len(data), desc="Processing files"):
-        base_filename = row['File']
-        input_path = os.path.join(input_dir, f"{base_filename}.mp3")
-        
-        if not os.path.exists(input_path):
-            print(f"File {input_path} not found. Skipping.")
-            continue
-        
-        # Iterate over the timestamp columns
-        for col in row.index[1:]:
-            if pd.notna(row[col]):
-                try:
-                    # Parse start and end times
-                    start_time, end_time = map(float, row[col].split(':'))
-                    # Generate output filename
-                    output_path = os.path.join(output_dir, f"{base_filename}_{start_time:.3f}-{end_time:.3f}.mp3")
-                    # Splice the audio with padding
-                    splice_audio(input_path, output_path, start_time, end_time)
-                except ValueError:
-                    print(f"Invalid timestamp format in column {col}: {row[col]}")
+
+    clip_ranges, errors = collect_clip_ranges(data, with_labels=True)
+    jobs = [
+        (find_source_file(input_dir, base_filename), output_dir, base_filename,
+         [(start, end) for _, start, end in ranges], [label for label, _, _ in ranges] if label_names else None)
+        for base_filename, ranges in clip_ranges.items()
+    ]
+
+    clips = 0
+    if workers <= 1:
+        # Process each file listed in the CSV in this process
+        for job in tqdm(jobs, desc="Processing files"):
+            written, job_errors = splice_file(*job)
+            clips += written
+            errors.extend(job_errors)
+    else:
+        # Spread the files across a process pool and aggregate progress here
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(splice_file, *job) for job in jobs]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Processing files"):
+                written, job_errors = future.result()
+                clips += written
+                errors.extend(job_errors)
+
+    return {"files": len(jobs), "clips": clips, "errors": errors}
 
 if __name__ == "__main__":
     # Define directories and CSV file
@@ -70,5 +231,9 @@ if __name__ == "__main__":
     output_directory = "../output/audio_clips"
     csv_file = "../data/timestamps.csv"
 
-    # Run the processing function
-    process_audio_clips(input_directory, output_directory, csv_file)
\ No newline at end of file
+    # Run the processing function on every available core
+    report = process_audio_clips(input_directory, output_directory, csv_file, workers=os.cpu_count())
+    if report is not None:
+        print(f"Wrote {report['clips']} clips from {report['files']} files.")
+        for error in report["errors"]:
+            print(f"Error processing {error['output'] or error['file']}: {error['error']}")
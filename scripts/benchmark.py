@@ -0,0 +1,371 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+from pydub import AudioSegment
+
+# Keyword columns of the synthetic timestamps.csv; spoken words are named after them
+KEYWORDS = ["yes", "no", "stop", "go"]
+
+
+def write_data_file(output_file, duration=60.0, rate=1000, bursts=(), offset=0.35, seed=0):
+    """
+    Write a synthetic .data file: a few header lines, the "***End_of_Header***" marker and Time/Current rows.
+    Args:
+        output_file (str): Path to the .data file.
+        duration (float): Length of the trace in seconds.
+        rate (int): Sensor sampling rate in Hz.
+        bursts (list): (start, end) audio times at which the sensor picks up activity.
+        offset (float): Delay of the sensor trace behind the audio in seconds.
+        seed (int): Seed of the random noise.
+    """
+    rng = np.random.default_rng(seed)
+    times = np.arange(int(duration * rate)) / rate
+    current = 1e-3 * rng.standard_normal(len(times))
+    for start, end in bursts:
+        active = (times >= start + offset) & (times <= end + offset)
+        current[active] += 1e-2 * np.sin(2 * np.pi * 50 * times[active])
+
+    with open(output_file, 'w') as f:
+        f.write(f"Synthetic sensor recording\nSampling rate: {rate} Hz\n***End_of_Header***\n")
+        np.savetxt(f, np.column_stack([times, current]), fmt=["%.6f", "%.9e"], delimiter=" ")
+
+
+def write_audio_file(output_file, duration=60.0, sample_rate=44100, bursts=(), seed=0):
+    """
+    Write a synthetic mono MP3 recording with a tone burst for every word.
+    Args:
+        output_file (str): Path to the .mp3 file.
+        duration (float): Length of the recording in seconds.
+        sample_rate (int): Sampling rate in Hz.
+        bursts (list): (start, end) times of the words in seconds.
+        seed (int): Seed of the random noise.
+    """
+    rng = np.random.default_rng(seed)
+    times = np.arange(int(duration * sample_rate)) / sample_rate
+    signal = 0.01 * rng.standard_normal(len(times))
+    for start, end in bursts:
+        active = (times >= start) & (times <= end)
+        signal[active] += 0.5 * np.sin(2 * np.pi * 440 * times[active])
+
+    samples = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    audio = AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=sample_rate, channels=1)
+    audio.export(output_file, format="mp3")
+
+
+def word_ranges(duration, repetitions, word_length=0.5):
+    """
+    Spread repetitions of every keyword evenly over a recording.
+    Returns:
+        list: (keyword, start, end) tuples in time order.
+    """
+    count = repetitions * len(KEYWORDS)
+    slot = duration / (count + 1)
+    return [(KEYWORDS[i % len(KEYWORDS)], (i + 1) * slot, (i + 1) * slot + word_length) for i in range(count)]
+
+
+def write_transcript_json(output_file, words):
+    """
+    Write a whisper_timestamped-style transcript with one segment per word.
+    Args:
+        output_file (str): Path to the transcript JSON file.
+        words (list): (keyword, start, end) tuples.
+    """
+    segments = [
+        {"id": i, "start": start, "end": end, "text": f" {keyword}",
+         "words": [{"text": keyword, "start": start, "end": end, "confidence": 0.9}]}
+        for i, (keyword, start, end) in enumerate(words)
+    ]
+    transcript = {"text": " ".join(keyword for keyword, _, _ in words), "segments": segments, "language": "en"}
+    with open(output_file, 'w') as json_file:
+        json.dump(transcript, json_file, indent=2)
+
+
+def make_fixtures(root, files=2, duration=60.0, data_rate=1000, audio_rate=44100, repetitions=5, seed=0):
+    """
+    Generate synthetic recordings, sensor traces, a timestamps.csv and transcripts.
+    Args:
+        root (str): Directory to write the fixtures to. It is emptied first.
+        files (int): Number of recordings.
+        duration (float): Length of each recording in seconds.
+        data_rate (int): Sensor sampling rate in Hz.
+        audio_rate (int): Audio sampling rate in Hz.
+        repetitions (int): Number of times each keyword is spoken per recording.
+        seed (int): Seed of the random noise.
+    Returns:
+        dict: Paths of the "audio_dir", "data_dir", "transcripts_dir" and "timestamps_csv" fixtures.
+    """
+    shutil.rmtree(root, ignore_errors=True)
+    fixtures = {name: os.path.join(root, name) for name in ("audio_dir", "data_dir", "transcripts_dir")}
+    for directory in fixtures.values():
+        os.makedirs(directory)
+    fixtures["timestamps_csv"] = os.path.join(root, "timestamps.csv")
+
+    words = word_ranges(duration, repetitions)
+    rows = []
+    for i in range(files):
+        name = f"recording{i}"
+        bursts = [(start, end) for _, start, end in words]
+        write_data_file(os.path.join(fixtures["data_dir"], f"{name}.data"), duration, data_rate, bursts,
+                        seed=seed + i)
+        write_audio_file(os.path.join(fixtures["audio_dir"], f"{name}.mp3"), duration, audio_rate, bursts,
+                         seed=seed + i)
+        write_transcript_json(os.path.join(fixtures["transcripts_dir"], f"{name}_transcript.json"), words)
+
+        # One row per repetition, one "start:end" cell per keyword
+        for r in range(repetitions):
+            row = {"File": name}
+            for keyword, start, end in words[r * len(KEYWORDS):(r + 1) * len(KEYWORDS)]:
+                row[keyword] = f"{start:.3f}:{end:.3f}"
+            rows.append(row)
+    pd.DataFrame(rows, columns=["File", *KEYWORDS]).to_csv(fixtures["timestamps_csv"], index=False)
+    return fixtures
+
+
+def expect_no_errors(report):
+    """
+    Check the report of a stage that returns one with an "errors" list.
+    Returns:
+        str: Why the run failed, or None if it succeeded.
+    """
+    if report is None:
+        return "returned no report"
+    if report.get("errors"):
+        return f"{len(report['errors'])} errors, first: {report['errors'][0]}"
+    return None
+
+
+def expect_outputs(directory):
+    """
+    Return a check that fails unless a stage wrote at least one file under a directory.
+    """
+    def check(_):
+        for _, _, filenames in os.walk(directory):
+            if filenames:
+                return None
+        return f"no output written to {directory}"
+    return check
+
+
+def measure(name, func, args=(), repeat=3, setup=None, checks=()):
+    """
+    Time a function over several runs, then run it once more under tracemalloc to record its peak memory.
+    The scripts' own output is suppressed. Memory used by subprocesses such as ffmpeg is not counted.
+    Since the scripts report most errors instead of raising, every run is validated with the checks,
+    so a stage that fails on every item is not timed as a fast success.
+    Args:
+        name (str): Name of the benchmark.
+        func (callable): Function to benchmark.
+        args (tuple): Arguments of the function.
+        repeat (int): Number of timed runs.
+        setup (callable): Called before every run, e.g. to clear the output directory.
+        checks (tuple): Callables taking the function's return value, each returning an error message or None.
+    Returns:
+        dict: "name", the wall times of each run in "seconds", their "best" and "median", "peak_memory_mb",
+              and "failed", the first failed check's message or None.
+    """
+    failed = None
+
+    def validate(value):
+        nonlocal failed
+        for check in checks:
+            message = check(value)
+            if message is not None and failed is None:
+                failed = message
+
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            value = func(*args)
+            seconds.append(time.perf_counter() - start)
+        validate(value)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        with redirect_stdout(io.StringIO()):
+            value = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    validate(value)
+
+    result = {"name": name, "seconds": seconds, "best": min(seconds), "median": float(np.median(seconds)),
+              "peak_memory_mb": peak / 2 ** 20, "failed": failed}
+    print(f"{name}: best {result['best']:.3f} s, median {result['median']:.3f} s, "
+          f"peak {result['peak_memory_mb']:.1f} MB" + (f"  FAILED: {failed}" if failed else ""))
+    return result
+
+
+def clear_directory(path):
+    """
+    Return a setup function that empties a directory.
+    """
+    def setup():
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+    return setup
+
+
+def git_commit():
+    """
+    Return the commit the scripts are checked out at, or None outside a git repository.
+    """
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def run_benchmarks(work_dir, output_json, repeat=3, files=2, duration=60.0, data_rate=1000, audio_rate=44100,
+                   repetitions=5):
+    """
+    Benchmark every pipeline stage on synthetic fixtures and save the results to JSON.
+    Runs offline: no recordings, Whisper model or GPU are needed.
+    Args:
+        work_dir (str): Scratch directory for the fixtures and outputs. It is emptied first.
+        output_json (str): Path to save the results.
+        repeat (int): Number of timed runs of each benchmark.
+        files (int): Number of synthetic recordings.
+        duration (float): Length of each recording in seconds.
+        data_rate (int): Sensor sampling rate in Hz.
+        audio_rate (int): Audio sampling rate in Hz.
+        repetitions (int): Number of times each keyword is spoken per recording.
+    Returns:
+        dict: The saved results.
+    """
+    from audio_cache import configure_cache
+    from data_segment_splicer import process_data_file, process_all_files
+    from audio_clip_splicer import process_audio_clips
+    from transcript_clipper import clip_transcripts
+    import generate_spectrograms_from_audio
+    import generate_spectrograms_from_data
+
+    # Measure decoding itself rather than reads from the decoded-audio cache
+    configure_cache(None)
+
+    fixture_params = {"files": files, "duration": duration, "data_rate": data_rate, "audio_rate": audio_rate,
+                      "repetitions": repetitions}
+    print(f"Generating fixtures in {work_dir}")
+    fixtures = make_fixtures(os.path.join(work_dir, "fixtures"), **fixture_params)
+    outputs = {name: os.path.join(work_dir, name)
+               for name in ("data_segments", "all_data_segments", "audio_clips", "wav", "data_spectrograms",
+                            "audio_spectrograms", "word_clips")}
+
+    data_file = os.path.join(fixtures["data_dir"], "recording0.data")
+    ranges = [(start, end) for _, start, end in word_ranges(duration, repetitions)]
+    # Parse the .data files on every run; the cached variant measures loading the binary cache instead
+    results = [
+        measure("process_data_file", process_data_file,
+                (data_file, ranges, outputs["data_segments"], 0.2, 0.2, 0.35, False),
+                repeat, clear_directory(outputs["data_segments"]), [expect_outputs(outputs["data_segments"])]),
+        measure("process_data_file_cached", process_data_file, (data_file, ranges, outputs["data_segments"]),
+                repeat, clear_directory(outputs["data_segments"]), [expect_outputs(outputs["data_segments"])]),
+        measure("process_all_files", process_all_files,
+                (fixtures["data_dir"], fixtures["timestamps_csv"], outputs["all_data_segments"], 0.2, 0.2, 0.35, False),
+                repeat, clear_directory(outputs["all_data_segments"]),
+                [expect_outputs(outputs["all_data_segments"])]),
+        measure("process_audio_clips", process_audio_clips,
+                (fixtures["audio_dir"], outputs["audio_clips"], fixtures["timestamps_csv"]),
+                repeat, clear_directory(outputs["audio_clips"]),
+                [expect_no_errors, expect_outputs(outputs["audio_clips"])]),
+    ]
+
+    # The spectrogram stages read the segments and clips written above
+    segment_csv = os.path.join(outputs["data_segments"], "recording0_0.csv")
+    results += [
+        measure("csv_to_wav", generate_spectrograms_from_data.csv_to_wav,
+                (segment_csv, os.path.join(outputs["wav"], "recording0_0.wav")),
+                repeat, clear_directory(outputs["wav"]), [expect_outputs(outputs["wav"])]),
+        measure("csvs_to_wav", generate_spectrograms_from_data.csvs_to_wav,
+                (outputs["data_segments"], outputs["wav"]),
+                repeat, clear_directory(outputs["wav"]), [expect_no_errors, expect_outputs(outputs["wav"])]),
+        measure("generate_spectrograms_from_data", generate_spectrograms_from_data.generate_spectrograms,
+                (outputs["data_segments"], None, outputs["data_spectrograms"]),
+                repeat, clear_directory(outputs["data_spectrograms"]),
+                [expect_outputs(outputs["data_spectrograms"])]),
+        measure("generate_spectrograms_from_audio", generate_spectrograms_from_audio.generate_spectrograms,
+                (outputs["audio_clips"], None, outputs["audio_spectrograms"]),
+                repeat, clear_directory(outputs["audio_spectrograms"]),
+                [expect_outputs(outputs["audio_spectrograms"])]),
+        measure("clip_transcripts", clip_transcripts,
+                (fixtures["transcripts_dir"], fixtures["audio_dir"], outputs["word_clips"]),
+                repeat, clear_directory(outputs["word_clips"]), [expect_outputs(outputs["word_clips"])]),
+    ]
+
+    failed = [result["name"] for result in results if result["failed"]]
+    if failed:
+        print(f"Failed benchmarks, whose timings are not meaningful: {', '.join(failed)}")
+
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": repeat,
+        "fixtures": fixture_params,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(output_json) or ".", exist_ok=True)
+    with open(output_json, 'w') as json_file:
+        json.dump(report, json_file, indent=2)
+    print(f"Results saved to {output_json}")
+    return report
+
+
+def compare_results(baseline_json, current_json, threshold=1.1):
+    """
+    Print how each benchmark changed between two result files and flag the regressions.
+    Args:
+        baseline_json (str): Results of the reference commit.
+        current_json (str): Results to compare against it.
+        threshold (float): Ratio of best times above which a benchmark counts as a regression.
+    Returns:
+        list: Names of the benchmarks that regressed, including those that failed in either file.
+    """
+    with open(baseline_json, 'r') as json_file:
+        baseline = {result["name"]: result for result in json.load(json_file)["results"]}
+    with open(current_json, 'r') as json_file:
+        current = json.load(json_file)["results"]
+
+    regressions = []
+    for result in current:
+        if result["name"] not in baseline:
+            continue
+        # A failed run is never compared; its time says nothing about the stage
+        failure = result.get("failed") or baseline[result["name"]].get("failed")
+        if failure:
+            regressions.append(result["name"])
+            print(f"{result['name']}: FAILED ({failure})")
+            continue
+        ratio = result["best"] / baseline[result["name"]]["best"]
+        memory_ratio = result["peak_memory_mb"] / max(baseline[result["name"]]["peak_memory_mb"], 1e-9)
+        flag = ""
+        if ratio > threshold:
+            regressions.append(result["name"])
+            flag = "  REGRESSION"
+        print(f"{result['name']}: {ratio:.2f}x time, {memory_ratio:.2f}x peak memory{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    # Scratch directory and results file
+    work_dir = "../output/benchmark"  # Fixtures and outputs; emptied on every run
+    output_json = "../output/benchmark_results.json"  # Compare runs of two commits with compare_results
+
+    run_benchmarks(work_dir, output_json)
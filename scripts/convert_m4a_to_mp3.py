@@ -1,36 +1,104 @@
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pydub import AudioSegment
+from tqdm import tqdm
 
-def convert_m4a_to_mp3(input_dir, output_dir):
+# Output formats and their file extensions. "flac" and "wav" are lossless, so the
+# downstream scripts decode the original samples instead of an MP3 re-encode.
+OUTPUT_FORMATS = {"mp3": ".mp3", "flac": ".flac", "wav": ".wav"}
+
+def convert_file(input_path, output_path, output_format="mp3"):
+    """
+    Convert a single .m4a file to another audio format.
+    The output is written to a temporary file and renamed into place, so an interrupted
+    conversion never leaves a truncated file behind.
+    Args:
+        input_path (str): Path to the .m4a file.
+        output_path (str): Path to save the converted file.
+        output_format (str): One of OUTPUT_FORMATS.
+    """
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        # Load the .m4a file
+        audio = AudioSegment.from_file(input_path, format="m4a")
+        # Export the file in the requested format
+        audio.export(temp_path, format=output_format)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def is_up_to_date(input_path, output_path):
+    """
+    Check whether a converted file exists and is at least as new as its source.
+    """
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+def convert_m4a_to_mp3(input_dir, output_dir, workers=1, output_format="mp3", force=False):
     """
     Convert all .m4a files in the input directory to .mp3 format and save them to the output directory.
+    Files whose converted output is newer than the source are skipped.
     Args:
         input_dir (str): Path to the directory containing .m4a files.
         output_dir (str): Path to the directory to save converted .mp3 files.
+        workers (int): Number of worker processes converting files in parallel.
+        output_format (str): "mp3", or "flac"/"wav" for lossless output.
+        force (bool): Convert every file even if its output is up to date.
+    Returns:
+        dict: Report with the number of "converted" and "skipped" files and a list of "errors".
     """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+
     # Create the output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
-    
-    # Iterate over all files in the input directory
-    for filename in os.listdir(input_dir):
+
+    # Collect the .m4a files whose output is missing or older than the source
+    jobs = []
+    skipped = 0
+    for filename in sorted(os.listdir(input_dir)):
         if filename.lower().endswith(".m4a"):
             input_path = os.path.join(input_dir, filename)
-            output_filename = os.path.splitext(filename)[0] + ".mp3"
+            output_filename = os.path.splitext(filename)[0] + OUTPUT_FORMATS[output_format]
             output_path = os.path.join(output_dir, output_filename)
-            
+            if not force and is_up_to_date(input_path, output_path):
+                skipped += 1
+                continue
+            jobs.append((filename, input_path, output_path))
+
+    report = {"converted": 0, "skipped": skipped, "errors": []}
+    if workers <= 1:
+        for filename, input_path, output_path in jobs:
             try:
-                # Load the .m4a file
-                audio = AudioSegment.from_file(input_path, format="m4a")
-                # Export the file as .mp3
-                audio.export(output_path, format="mp3")
-                print(f"Converted: {filename} -> {output_filename}")
+                convert_file(input_path, output_path, output_format)
+                report["converted"] += 1
+                print(f"Converted: {filename} -> {os.path.basename(output_path)}")
             except Exception as e:
+                report["errors"].append({"file": filename, "error": str(e)})
                 print(f"Error converting {filename}: {e}")
+    else:
+        # Each worker decodes and encodes one file at a time
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(convert_file, input_path, output_path, output_format): (filename, output_path)
+                for filename, input_path, output_path in jobs
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Converting files"):
+                filename, output_path = futures[future]
+                try:
+                    future.result()
+                    report["converted"] += 1
+                except Exception as e:
+                    report["errors"].append({"file": filename, "error": str(e)})
+                    print(f"Error converting {filename}: {e}")
+
+    print(f"Converted {report['converted']} files, {report['skipped']} already up to date.")
+    return report
 
 if __name__ == "__main__":
     # Define input and output directories
     input_directory = "../data/audio_clips"  # Update with your .m4a files directory
     output_directory = "../data/audio_clips"  # Update with your desired output directory
-        
-    # Run the conversion function
-    convert_m4a_to_mp3(input_directory, output_directory)
\ No newline at end of file
+
+    # Run the conversion function on every available core; use output_format="flac" to skip the lossy MP3 step
+    convert_m4a_to_mp3(input_directory, output_directory, workers=os.cpu_count())
@@ -1,5 +1,179 @@
+import io
 import os
+import warnings
+import numpy as np
 import pandas as pd
+from instrumentation import file_size, track
+from timestamps import index_timestamps, load_timestamps
+
+
+def _skip_header(read_file):
+    """
+    Advance an open .data file past the "***End_of_Header***" line.
+    Args:
+        read_file (file): File opened for reading.
+    """
+    while True:
+        line = read_file.readline()
+        if "***End_of_Header***" in line:
+            return
+        if not line:
+            raise ValueError(f"No ***End_of_Header*** marker found in {read_file.name}")
+
+
+def _parse_data_lines(read_file):
+    """
+    Parse the remaining (Time, Current) rows of a .data file line by line.
+    Used as the exact fallback when the bulk parser meets a line it cannot handle.
+    Args:
+        read_file (file): File positioned just after the header.
+    Returns:
+        np.ndarray: Array of shape (2, N) holding the Time and Current columns.
+    """
+    data = []
+    for line in read_file:
+        line = line.strip()
+        if not line:  # Skip empty lines
+            continue
+
+        line_split = line.split()
+        if len(line_split) != 2:  # Skip malformed lines
+            continue
+
+        try:
+            time = float(line_split[0])
+            current = float(line_split[1])
+            data.append([time, current])
+        except ValueError:
+            continue  # Skip lines with invalid numerical values
+
+    return np.array(data, dtype=np.float64).reshape(-1, 2).T
+
+
+def _parse_data_body(read_file):
+    """
+    Parse (Time, Current) rows in bulk with the pandas C parser.
+    Lines with a third field are dropped like the line-by-line parser does. A missing field and a
+    literal "nan" both come out as NaN here, so if any row has a NaN, or a line cannot be handled in
+    bulk, the rows are re-read line by line to keep exactly the lines that failed to parse out.
+    Args:
+        read_file (file): Seekable file positioned at the first data row.
+    Returns:
+        np.ndarray: Array of shape (2, N) holding the Time and Current columns.
+    """
+    body_start = read_file.tell()
+    try:
+        with warnings.catch_warnings():
+            # A surplus field on the first row is truncated with a warning instead of skipped
+            warnings.simplefilter("error", pd.errors.ParserWarning)
+            rows = pd.read_csv(read_file, sep=r"\s+", header=None, names=["Time", "Current", "Extra"],
+                               index_col=False, dtype=np.float64, on_bad_lines="skip", engine="c",
+                               keep_default_na=False)
+    except (ValueError, pd.errors.ParserWarning):
+        read_file.seek(body_start)
+        return _parse_data_lines(read_file)
+
+    # Keep only the rows with exactly two fields
+    rows = rows[rows["Extra"].isna()]
+    columns = rows[["Time", "Current"]].to_numpy()
+    if np.isnan(columns).any():
+        # A single-field line or a literal "nan"; only the line parser tells them apart
+        read_file.seek(body_start)
+        return _parse_data_lines(read_file)
+    return np.ascontiguousarray(columns.T)
+
+
+def parse_data_file(filepath):
+    """
+    Parse a .data file into its Time and Current columns.
+    Args:
+        filepath (str): Path to the input .data file.
+    Returns:
+        np.ndarray: Array of shape (2, N) holding the Time and Current columns.
+    """
+    with open(filepath, "r") as read_file:
+        # Skip header lines until "End_of_Header"
+        _skip_header(read_file)
+        return _parse_data_body(read_file)
+
+
+def parse_data_block(lines):
+    """
+    Parse a block of whole (Time, Current) lines that follow the header of a .data file.
+    Args:
+        lines (list): Lines of text, each ending with a newline.
+    Returns:
+        np.ndarray: Array of shape (2, n) holding the Time and Current columns.
+    """
+    return _parse_data_body(io.StringIO("".join(lines)))
+
+
+def iter_data_chunks(filepath, chunk_bytes=1 << 24):
+    """
+    Parse a .data file in blocks of whole lines, without loading the full trace.
+    Each block is parsed on its own exactly like parse_data_file parses the whole body.
+    Args:
+        filepath (str): Path to the input .data file.
+        chunk_bytes (int): Approximate size of each block of text in bytes.
+    Returns:
+        generator: Yields arrays of shape (2, n) holding consecutive Time and Current rows.
+    """
+    with open(filepath, "r") as read_file:
+        # Skip header lines until "End_of_Header"
+        _skip_header(read_file)
+        while True:
+            lines = read_file.readlines(chunk_bytes)
+            if not lines:
+                return
+            yield parse_data_block(lines)
+
+
+def _cache_path(filepath):
+    """
+    Build the sidecar cache path of a .data file, keyed on its size and modification time.
+    """
+    stat = os.stat(filepath)
+    return f"{filepath}.{stat.st_size}-{stat.st_mtime_ns}.npy"
+
+
+def load_data_file(filepath, use_cache=True):
+    """
+    Load a .data file into a DataFrame, using a memory-mapped binary cache when available.
+    The cache is a .npy file next to the .data file. Its name records the size and
+    modification time of the source, so editing the .data file invalidates it.
+    Args:
+        filepath (str): Path to the input .data file.
+        use_cache (bool): Whether to read and write the binary cache.
+    Returns:
+        pd.DataFrame: DataFrame with "Time" and "Current" columns.
+    """
+    if not use_cache:
+        columns = parse_data_file(filepath)
+    else:
+        cache_file = _cache_path(filepath)
+        if os.path.exists(cache_file):
+            columns = np.load(cache_file, mmap_mode="r")
+        else:
+            columns = parse_data_file(filepath)
+
+            # Remove caches of older versions of the file, then write the new one atomically.
+            # The data directory may be read-only; the parsed columns are used either way.
+            cache_prefix = os.path.basename(filepath) + "."
+            cache_dir = os.path.dirname(filepath) or "."
+            temp_file = cache_file + ".tmp"
+            try:
+                for name in os.listdir(cache_dir):
+                    if name.startswith(cache_prefix) and name.endswith(".npy"):
+                        os.remove(os.path.join(cache_dir, name))
+                with open(temp_file, "wb") as write_file:
+                    np.save(write_file, columns)
+                os.replace(temp_file, cache_file)
+            except OSError as e:
+                print(f"Could not write the cache of {filepath}: {e}")
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+
+    return pd.DataFrame({"Time": columns[0], "Current": columns[1]})
 
 
 def save_segment_to_csv(segment, output_folder, filename, segment_number):
@@ -16,64 +190,277 @@ def save_segment_to_csv(segment, output_folder, filename, segment_number):
     print(f"Segment {segment_number} saved to {output_file}")
 
 
-def process_data_file(filepath, timestamps, output_root, padding_before=0.2, padding_after=0.2, offset=0.35):
+def save_segment_bundle(segments, output_file, output_format="npz"):
     """
-    Process a single .data file, cutting it into segments based on timestamps.
+    Save many segments into a single columnar file.
+    An NPZ bundle holds the concatenated "time" and "current" arrays, an "offsets" array where
+    segment i spans offsets[i]:offsets[i + 1], and the segment "names". A Parquet bundle holds
+    Time and Current columns plus a "segment_id" column with the segment name.
+    Args:
+        segments (list): List of (segment_name, pd.DataFrame) tuples.
+        output_file (str): Path to the output bundle.
+        output_format (str): Either "npz" or "parquet".
+    """
+    names = [name for name, _ in segments]
+    frames = [segment[["Time", "Current"]] for _, segment in segments]
+    if output_format == "npz":
+        lengths = np.array([len(frame) for frame in frames], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        time = np.concatenate([frame["Time"].to_numpy() for frame in frames]) if frames else np.empty(0)
+        current = np.concatenate([frame["Current"].to_numpy() for frame in frames]) if frames else np.empty(0)
+        np.savez(output_file, time=time, current=current, offsets=offsets, names=np.array(names, dtype=str))
+    elif output_format == "parquet":
+        bundle = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["Time", "Current"])
+        bundle.insert(0, "segment_id", np.repeat(names, [len(frame) for frame in frames]).astype(str))
+        bundle.to_parquet(output_file, index=False)
+    else:
+        raise ValueError(f"Unsupported bundle format: {output_format}")
+    print(f"{len(segments)} segments saved to {output_file}")
+
+
+def read_segment_bundle(bundle_file):
+    """
+    Read the segments of a bundle written by save_segment_bundle.
+    Args:
+        bundle_file (str): Path to an .npz or .parquet bundle.
+    Returns:
+        generator: Yields (segment_name, pd.DataFrame) tuples with "Time" and "Current" columns, in saved order.
+    """
+    if bundle_file.endswith(".npz"):
+        with np.load(bundle_file) as bundle:
+            time, current, offsets, names = bundle["time"], bundle["current"], bundle["offsets"], bundle["names"]
+        for i, name in enumerate(names):
+            start, stop = offsets[i], offsets[i + 1]
+            yield str(name), pd.DataFrame({"Time": time[start:stop], "Current": current[start:stop]})
+    elif bundle_file.endswith(".parquet"):
+        bundle = pd.read_parquet(bundle_file)
+        for name, segment in bundle.groupby("segment_id", sort=False):
+            yield str(name), segment[["Time", "Current"]].reset_index(drop=True)
+    else:
+        raise ValueError(f"Unsupported bundle file: {bundle_file}")
+
+
+def read_bundle_names(bundle_file):
+    """
+    Read only the segment names of a bundle written by save_segment_bundle, in saved order.
+    Args:
+        bundle_file (str): Path to an .npz or .parquet bundle.
+    Returns:
+        list: Names of the segments.
+    """
+    if bundle_file.endswith(".npz"):
+        with np.load(bundle_file) as bundle:
+            return [str(name) for name in bundle["names"]]
+    elif bundle_file.endswith(".parquet"):
+        return [str(name) for name in pd.read_parquet(bundle_file, columns=["segment_id"])["segment_id"].unique()]
+    else:
+        raise ValueError(f"Unsupported bundle file: {bundle_file}")
+
+
+def segment_name(filename, segment_number, label=None):
+    """
+    Build the name of a segment, "<filename>_<segment_number>", prefixed with its keyword label if given.
+    """
+    name = f"{filename}_{segment_number}"
+    return f"{label}_{name}" if label is not None else name
+
+
+def segment_bounds(times, timestamps, padding_before=0.2, padding_after=0.2, offset=0.35):
+    """
+    Resolve the rows of every timestamp range in a trace.
+    A row belongs to a range when start + offset - padding_before <= Time <= end + offset + padding_after,
+    with the start clamped at 0. For a sorted Time column the bounds come from a binary search
+    and each range is a slice, so segments are views of the trace; otherwise each range falls
+    back to a boolean mask.
+    Args:
+        times (np.ndarray): Time column of the trace.
+        timestamps (list): List of tuples with start and end times.
+        padding_before (float): Padding to add before the start of each segment in seconds.
+        padding_after (float): Padding to add after the end of each segment in seconds.
+        offset (float): Offset to apply to all timestamps in seconds.
+    Returns:
+        list: One row selector (a slice, or an index array for unsorted traces) per timestamp range.
+    """
+    ranges = np.asarray(timestamps, dtype=np.float64).reshape(-1, 2)
+
+    # Apply offset and padding
+    start_times = np.maximum(0, ranges[:, 0] + offset - padding_before)
+    end_times = ranges[:, 1] + offset + padding_after
+
+    if np.all(times[1:] >= times[:-1]):
+        lo = np.searchsorted(times, start_times, side="left")
+        hi = np.maximum(lo, np.searchsorted(times, end_times, side="right"))
+        return [slice(start, stop) for start, stop in zip(lo.tolist(), hi.tolist())]
+
+    # Fall back to a boolean mask per range if the trace is not sorted
+    return [np.flatnonzero((times >= start_time) & (times <= end_time))
+            for start_time, end_time in zip(start_times, end_times)]
+
+
+def extract_segments(filepath, timestamps, padding_before=0.2, padding_after=0.2, offset=0.35, use_cache=True,
+                     labels=None):
+    """
+    Cut a single .data file into segments based on timestamps.
     Args:
         filepath (str): Path to the input .data file.
         timestamps (list): List of tuples with start and end times.
-        output_root (str): Path to the output directory.
         padding_before (float): Padding to add before the start of each segment in seconds.
         padding_after (float): Padding to add after the end of each segment in seconds.
         offset (float): Offset to apply to all timestamps in seconds.
+        use_cache (bool): Whether to read and write the binary cache of the parsed trace.
+        labels (list): Optional keyword label of each timestamp range, used as a prefix of the segment names.
+    Returns:
+        list: (segment_name, pd.DataFrame) tuples for the non-empty segments, named "<filename>_<segment_number>".
     """
     # Extract filename without extension
     filename = os.path.splitext(os.path.basename(filepath))[0]
 
-    with open(filepath, "r") as read_file:
-        # Skip header lines until "End_of_Header"
-        while True:
-            line = read_file.readline()
-            if "***End_of_Header***" in line:
-                break
-
-        # Read the data rows into a list
-        data = []
-        for line in read_file:
-            line = line.strip()
-            if not line:  # Skip empty lines
-                continue
+    # Load the Time/Current trace
+    df = load_data_file(filepath, use_cache=use_cache)
 
-            line_split = line.split()
-            if len(line_split) != 2:  # Skip malformed lines
-                continue
+    # Resolve the bounds of every timestamp range at once
+    selectors = segment_bounds(df["Time"].to_numpy(), timestamps, padding_before, padding_after, offset)
 
-            try:
-                time = float(line_split[0])
-                current = float(line_split[1])
-                data.append([time, current])
-            except ValueError:
-                continue  # Skip lines with invalid numerical values
+    # Process each timestamp range
+    segments = []
+    for i, rows in enumerate(selectors):
+        # Extract the segment
+        segment = df.iloc[rows]
+
+        if not segment.empty:
+            label = labels[i] if labels is not None else None
+            segments.append((segment_name(filename, len(segments), label), segment))
+    return segments
 
-    # Convert data to a DataFrame
-    df = pd.DataFrame(data, columns=["Time", "Current"])
 
-    # Process each timestamp range
+def stream_segments(filepath, timestamps, padding_before=0.2, padding_after=0.2, offset=0.35, chunk_bytes=1 << 24,
+                    labels=None):
+    """
+    Cut a .data file into segments while reading it in blocks, with the same output as extract_segments.
+    Ranges are opened in order of their padded start time and a segment is finished as soon as a
+    block reaches past its padded end time, so memory stays bounded by the block size plus the
+    segments in progress. Finished segments are released in timestamp list order, so a segment
+    only waits for ranges listed before it. The Time column must be in ascending order.
+    Args:
+        filepath (str): Path to the input .data file.
+        timestamps (list): List of tuples with start and end times.
+        padding_before (float): Padding to add before the start of each segment in seconds.
+        padding_after (float): Padding to add after the end of each segment in seconds.
+        offset (float): Offset to apply to all timestamps in seconds.
+        chunk_bytes (int): Approximate size of each block of text in bytes.
+        labels (list): Optional keyword label of each timestamp range, used as a prefix of the segment names.
+    Returns:
+        generator: Yields (segment_name, pd.DataFrame) tuples for the non-empty segments,
+                   named "<filename>_<segment_number>".
+    """
+    # Extract filename without extension
+    filename = os.path.splitext(os.path.basename(filepath))[0]
+
+    ranges = np.asarray(timestamps, dtype=np.float64).reshape(-1, 2)
+
+    # Apply offset and padding
+    start_times = np.maximum(0, ranges[:, 0] + offset - padding_before)
+    end_times = ranges[:, 1] + offset + padding_after
+    opening_order = np.argsort(start_times, kind="stable").tolist()
+
+    pieces = {}  # Rows collected so far for each open range
+    finished = {}  # Rows of finished ranges waiting for the ranges listed before them
+    next_to_open = 0
+    next_to_emit = 0
     segment_number = 0
-    for start, end in timestamps:
-        # Apply offset and padding
-        start_time = max(0, start + offset - padding_before)
-        end_time = end + offset + padding_after
+    last_time = -np.inf
 
-        # Extract the segment
-        segment = df[(df["Time"] >= start_time) & (df["Time"] <= end_time)]
+    def release():
+        nonlocal next_to_emit, segment_number
+        while next_to_emit in finished:
+            parts = finished.pop(next_to_emit)
+            label = labels[next_to_emit] if labels is not None else None
+            next_to_emit += 1
+            if parts:
+                columns = np.concatenate(parts, axis=1)
+                yield (segment_name(filename, segment_number, label),
+                       pd.DataFrame({"Time": columns[0], "Current": columns[1]}))
+                segment_number += 1
+
+    for chunk in iter_data_chunks(filepath, chunk_bytes):
+        times = chunk[0]
+        if not len(times):
+            continue
+        if times[0] < last_time or np.any(times[1:] < times[:-1]):
+            raise ValueError(f"Time column of {filepath} is not sorted; streaming needs ascending times")
+        last_time = times[-1]
+
+        # Open the ranges that start within the rows read so far
+        while next_to_open < len(opening_order) and start_times[opening_order[next_to_open]] <= last_time:
+            pieces[opening_order[next_to_open]] = []
+            next_to_open += 1
+
+        for i in list(pieces):
+            lo = np.searchsorted(times, start_times[i], side="left")
+            hi = np.searchsorted(times, end_times[i], side="right")
+            if hi > lo:
+                pieces[i].append(chunk[:, lo:hi])
+
+            # No later row can fall in a range whose end has been passed
+            if last_time > end_times[i]:
+                finished[i] = pieces.pop(i)
+
+        yield from release()
+
+    # Every range still open, or never opened, ends with the file
+    for i in range(len(ranges)):
+        if i not in finished and i >= next_to_emit:
+            finished[i] = pieces.pop(i, [])
+    yield from release()
 
-        if not segment.empty:
-            save_segment_to_csv(segment, output_root, filename, segment_number)
-            segment_number += 1
 
+def process_data_file(filepath, timestamps, output_root, padding_before=0.2, padding_after=0.2, offset=0.35,
+                      use_cache=True, output_format="csv", chunk_bytes=None, labels=None):
+    """
+    Process a single .data file, cutting it into segments based on timestamps.
+    Args:
+        filepath (str): Path to the input .data file.
+        timestamps (list): List of tuples with start and end times.
+        output_root (str): Path to the output directory.
+        padding_before (float): Padding to add before the start of each segment in seconds.
+        padding_after (float): Padding to add after the end of each segment in seconds.
+        offset (float): Offset to apply to all timestamps in seconds.
+        use_cache (bool): Whether to read and write the binary cache of the parsed trace.
+        output_format (str): "csv" for one CSV per segment, or "npz"/"parquet" for one
+                             "<filename>_segments" bundle holding all segments of the file.
+        chunk_bytes (int): If set, stream the file in blocks of about this many bytes with stream_segments
+                           instead of loading the whole trace. The binary cache is not used in this mode.
+        labels (list): Optional keyword label of each timestamp range. Segments are then named
+                       "<label>_<filename>_<segment_number>", so the spectrogram generator files them by keyword.
+    """
+    # Extract filename without extension
+    filename = os.path.splitext(os.path.basename(filepath))[0]
+
+    with track("process_data_file", filepath) as item:
+        item.add_bytes(read=file_size(filepath))
+        if chunk_bytes:
+            # Segments are parsed lazily, so parsing is timed as part of "write"
+            segments = stream_segments(filepath, timestamps, padding_before, padding_after, offset, chunk_bytes,
+                                       labels)
+        else:
+            with item.phase("extract"):
+                segments = extract_segments(filepath, timestamps, padding_before, padding_after, offset, use_cache,
+                                            labels)
 
-def process_all_files(input_directory, timestamps_csv, output_directory, padding_before=0.2, padding_after=0.2, offset=0.35):
+        with item.phase("write"):
+            if output_format == "csv":
+                for name, segment in segments:
+                    prefix, segment_number = name.rsplit("_", 1)
+                    save_segment_to_csv(segment, output_root, prefix, segment_number)
+                    item.add_bytes(written=file_size(os.path.join(output_root, f"{name}.csv")))
+            else:
+                output_file = os.path.join(output_root, f"{filename}_segments.{output_format}")
+                save_segment_bundle(list(segments), output_file, output_format)
+                item.add_bytes(written=file_size(output_file))
+
+def process_all_files(input_directory, timestamps_csv, output_directory, padding_before=0.2, padding_after=0.2, offset=0.35,
+                      use_cache=True, output_format="csv", bundle_per_run=False, chunk_bytes=None, offsets_csv=None,
+                      label_names=False):
     """
     Process all .data files in a directory based on timestamps from a CSV file.
     Args:
@@ -83,16 +470,37 @@ def process_all_files(input_directory, timestamps_csv, output_directory, padding
         padding_before (float): Padding to add before the start of each segment in seconds.
         padding_after (float): Padding to add after the end of each segment in seconds.
         offset (float): Offset to apply to all timestamps in seconds.
+        use_cache (bool): Whether to read and write the binary cache of each parsed .data file.
+        output_format (str): "csv" for one CSV per segment, or "npz"/"parquet" for columnar bundles.
+        bundle_per_run (bool): With a bundle format, write a single "segments" bundle for the whole run
+                               instead of one bundle per .data file.
+        chunk_bytes (int): If set, stream each .data file in blocks of about this many bytes
+                           instead of loading the whole trace.
+        offsets_csv (str): Optional table from sensor_alignment.align_files with per-file "offset" and
+                           "drift" columns. Listed files use these instead of the constant offset.
+        label_names (bool): Prefix each segment name with the CSV column label of its range, so the
+                            spectrogram generator files it under that keyword.
     """
-    # Load the timestamp data
-    timestamp_data = pd.read_csv(timestamps_csv)
-
-    # Ensure the first column is 'File'
-    if 'File' not in timestamp_data.columns:
-        print("The CSV file must contain a 'File' column.")
+    # Load and index the timestamp data once for all files
+    try:
+        table, invalid = load_timestamps(timestamps_csv)
+    except ValueError as e:
+        print(e)
         return
+    # Segments are numbered column by column, as the ranges appear in each label's column
+    file_timestamps = index_timestamps(table, order="column")
+    file_errors = {}
+    for cell in invalid:
+        file_errors.setdefault(cell["file"], []).append(cell["value"])
+
+    # Load the per-file offsets, if any
+    file_offsets = {}
+    if offsets_csv is not None:
+        offsets_data = pd.read_csv(offsets_csv)
+        file_offsets = {row.File: (row.offset, row.drift) for row in offsets_data.itertuples(index=False)}
 
     os.makedirs(output_directory, exist_ok=True)
+    run_segments = []
 
     # Process each .data file in the input directory
     for filename in os.listdir(input_directory):
@@ -102,23 +510,35 @@ def process_all_files(input_directory, timestamps_csv, output_directory, padding
 
             # Get the corresponding timestamps for this file
             file_name_no_ext = os.path.splitext(filename)[0]
-            if file_name_no_ext not in timestamp_data['File'].values:
+            for value in file_errors.get(file_name_no_ext, []):
+                print(f"Invalid timestamp format: {value}. Skipping.")
+            if file_name_no_ext not in file_timestamps and file_name_no_ext not in file_errors:
                 print(f"No timestamps found for {file_name_no_ext}. Skipping.")
                 continue
+            entries = file_timestamps.get(file_name_no_ext, [])
+            timestamp_ranges = [(start, end) for _, start, end in entries]
+            labels = [label for label, _, _ in entries] if label_names else None
 
-            # Extract timestamps for the current file
-            file_timestamps = timestamp_data[timestamp_data['File'] == file_name_no_ext]
-            timestamp_ranges = []
-            for col in file_timestamps.columns[1:]:
-                for entry in file_timestamps[col].dropna():
-                    try:
-                        start, end = map(float, entry.split(":"))
-                        timestamp_ranges.append((start, end))
-                    except ValueError:
-                        print(f"Invalid timestamp format: {entry}. Skipping.")
+            # Use the estimated offset of this file; a drift scales the audio timestamps
+            file_offset = offset
+            if file_name_no_ext in file_offsets:
+                file_offset, drift = file_offsets[file_name_no_ext]
+                timestamp_ranges = [(start * (1 + drift), end * (1 + drift)) for start, end in timestamp_ranges]
 
             # Process the file with the extracted timestamps
-            process_data_file(filepath, timestamp_ranges, output_directory, padding_before, padding_after, offset)
+            if bundle_per_run and output_format != "csv":
+                if chunk_bytes:
+                    run_segments.extend(stream_segments(filepath, timestamp_ranges, padding_before, padding_after,
+                                                        file_offset, chunk_bytes, labels))
+                else:
+                    run_segments.extend(extract_segments(filepath, timestamp_ranges, padding_before, padding_after,
+                                                         file_offset, use_cache, labels))
+            else:
+                process_data_file(filepath, timestamp_ranges, output_directory, padding_before, padding_after,
+                                  file_offset, use_cache, output_format, chunk_bytes, labels)
+
+    if bundle_per_run and output_format != "csv":
+        save_segment_bundle(run_segments, os.path.join(output_directory, f"segments.{output_format}"), output_format)
 
     print("All files processed.")
 
@@ -1,9 +1,10 @@
 import os
-import librosa
-import librosa.display
 import numpy as np
 from pydub import AudioSegment
-import matplotlib.pyplot as plt
+from audio_cache import segment_samples
+from instrumentation import file_size, track
+from spectrogram_dataset import DatasetManifestWriter, SpectrogramDatasetWriter, recording_name
+from spectrogram_utils import IMAGE_SIZE, Clip, save_spectrograms
 
 
 def mp3_to_wav(input_file, output_file):
@@ -21,29 +22,80 @@ def mp3_to_wav(input_file, output_file):
     print(f"Converted {input_file} to WAV: {output_file}")
 
 
-def generate_spectrograms(mp3_dir, wav_output_dir, spectrogram_output_dir, frame_size=2048, hop_size=512):
+def audio_to_signal(audio):
+    """
+    Convert decoded audio to a mono float32 signal in the range [-1, 1].
+    Channels are averaged and samples scaled the same way librosa.load does for a PCM WAV file.
+    Args:
+        audio (AudioSegment): Decoded audio.
+    Returns:
+        tuple: The signal as a np.ndarray and its sampling rate.
+    """
+    samples = segment_samples(audio)
+    signal = samples.astype(np.float32) / float(1 << (8 * audio.sample_width - 1))
+    return signal.mean(axis=1), audio.frame_rate
+
+
+def generate_spectrograms(mp3_dir, wav_output_dir, spectrogram_output_dir, frame_size=2048, hop_size=512,
+                          batch_size=None, image_mode="raster", image_size=IMAGE_SIZE,
+                          dataset_path=None, dataset_format="hdf5", feature_mode=None,
+                          manifest_path=None, shard_dir=None, shard_size=1024, label_names=False):
     """
     Generate spectrograms from MP3 files and save them as images.
+    The decoded signal is fed straight into the STFT; WAV files are only written on request.
     Args:
         mp3_dir (str): Directory containing MP3 files.
-        wav_output_dir (str): Directory to save WAV files.
+        wav_output_dir (str): Directory to save WAV files, or None to skip writing them.
         spectrogram_output_dir (str): Directory to save spectrogram images.
         frame_size (int): Frame size for STFT.
         hop_size (int): Hop size for STFT.
+        batch_size (int): If set, compute the STFTs of this many clips at a time in length-bucketed batches.
+        image_mode (str): "raster" to write fixed-size images directly, "plot" to draw them with matplotlib,
+                          or None to skip images.
+        image_size (tuple): Output (height, width) of raster images and dataset entries in pixels.
+        dataset_path (str): If set, also store every dB spectrogram, resized to image_size, with its label
+                            and source file in a single array store at this path.
+        dataset_format (str): "hdf5" for one .h5 file, or "npy" for a directory with a memory-mappable .npy file.
+        feature_mode (str): "mel" to also save a compact log-mel spectrogram and MFCCs of each clip
+                            as "<name>_features.npz" in the keyword directory. With image_mode=None,
+                            only the features are computed.
+        manifest_path (str): If set, also write a CSV manifest with the path, label, source recording,
+                             bounds, shape and train/val/test split of every spectrogram.
+        shard_dir (str): If set along with manifest_path, also write the resized dB spectrograms to
+                         per-split shards of shard_size entries in this directory, in dataset_format.
+        shard_size (int): Number of spectrograms per shard.
+        label_names (bool): Whether the names start with a label prefix, i.e. the splicers ran with
+                            label_names=True. The prefix is then left out of the manifest's recording names.
     """
-    os.makedirs(wav_output_dir, exist_ok=True)
+    if wav_output_dir is not None:
+        os.makedirs(wav_output_dir, exist_ok=True)
     os.makedirs(spectrogram_output_dir, exist_ok=True)
 
     # Process each MP3 file
     mp3_files = [os.path.join(mp3_dir, f) for f in os.listdir(mp3_dir) if f.endswith(".mp3")]
+    pending = []
+    dataset = SpectrogramDatasetWriter(dataset_path, image_size, dataset_format) if dataset_path else None
+    manifest = None
+    if manifest_path:
+        # Splits are cut over all recordings, so list them before the first clip is added
+        names = [os.path.splitext(os.path.basename(mp3_file))[0] for mp3_file in mp3_files]
+        recordings = [recording_name(name, name.split('_')[0] if label_names else None) for name in names]
+        manifest = DatasetManifestWriter(manifest_path, image_size, shard_dir, shard_size, dataset_format,
+                                         recordings=recordings)
     for i, mp3_file in enumerate(mp3_files, start=1):
         try:
-            # Generate the WAV file name
             base_name = os.path.splitext(os.path.basename(mp3_file))[0]
-            wav_file = os.path.join(wav_output_dir, f"{base_name}.wav")
 
-            # Convert MP3 to WAV
-            mp3_to_wav(mp3_file, wav_file)
+            # Decode the MP3 file once; clips are read a single time, so they bypass the decoded-audio cache
+            with track("decode_audio", mp3_file) as item, item.phase("decode"):
+                audio = AudioSegment.from_file(mp3_file)
+                item.add_bytes(read=file_size(mp3_file))
+
+            # Save the WAV file only if requested
+            if wav_output_dir is not None:
+                wav_file = os.path.join(wav_output_dir, f"{base_name}.wav")
+                audio.export(wav_file, format="wav")
+                print(f"Converted {mp3_file} to WAV: {wav_file}")
 
             # Extract the keyword (assumes keyword is before the first underscore '_')
             keyword = base_name.split('_')[0]
@@ -52,36 +104,49 @@ def generate_spectrograms(mp3_dir, wav_output_dir, spectrogram_output_dir, frame
             keyword_dir = os.path.join(spectrogram_output_dir, keyword)
             os.makedirs(keyword_dir, exist_ok=True)
 
-            # Load the WAV file for spectrogram generation
-            signal, sr = librosa.load(wav_file, sr=None)
+            # Use the decoded signal directly for spectrogram generation
+            signal, sr = audio_to_signal(audio)
 
-            # Compute the STFT and spectrogram
-            S = librosa.stft(signal, n_fft=frame_size, hop_length=hop_size)
-            Y = np.abs(S) ** 2
-            Y_log_scale = librosa.power_to_db(Y)
-
-            # Plot the spectrogram
-            plt.figure(figsize=(10, 6))
-            plt.axis('off')  # Hide axes
-            plt.pcolormesh(librosa.times_like(S, sr=sr, hop_length=hop_size),
-                           librosa.fft_frequencies(sr=sr, n_fft=frame_size),
-                           Y_log_scale, shading='gouraud', cmap='inferno')
-
-            # Save the spectrogram in the keyword-specific subdirectory
+            # Queue the clip; its spectrogram is saved in the keyword-specific subdirectory
             spectrogram_path = os.path.join(keyword_dir, f"{base_name}_spectrogram.png")
-            plt.savefig(spectrogram_path, bbox_inches='tight', pad_inches=0)
-            plt.close()
-            print(f"Spectrogram saved: {spectrogram_path}")
+
+            # Bounds of the clip in its recording, from the "<start>-<end>" suffix of its name
+            start, end = None, None
+            try:
+                start, end = map(float, base_name.rsplit('_', 1)[-1].split('-'))
+            except ValueError:
+                pass
+            pending.append(Clip(signal, sr, base_name, keyword, mp3_file, spectrogram_path,
+                                recording_name(base_name, keyword if label_names else None), start, end))
 
         except Exception as e:
             print(f"Error processing {mp3_file}: {e}")
+            continue
+
+        # Compute and save the spectrograms once the batch is full
+        if len(pending) >= (batch_size or 1):
+            save_spectrograms(pending, frame_size, hop_size, batched=batch_size is not None,
+                              image_mode=image_mode, image_size=image_size, dataset=dataset,
+                              feature_mode=feature_mode, manifest=manifest)
+            pending = []
+
+    if pending:
+        save_spectrograms(pending, frame_size, hop_size, batched=batch_size is not None,
+                          image_mode=image_mode, image_size=image_size, dataset=dataset,
+                          feature_mode=feature_mode, manifest=manifest)
+
+    if dataset is not None:
+        dataset.close()
+    if manifest is not None:
+        manifest.close()
 
 
 if __name__ == "__main__":
     # Directories
     mp3_dir = "../output/audio_clips"  # Directory containing MP3 files
-    wav_output_dir = "../output/audio_wav_files"  # Directory to save WAV files
+    wav_output_dir = None  # Set to a directory such as "../output/audio_wav_files" to also save WAV files
     spectrogram_output_dir = "../output/audio_spectrograms"  # Directory to save spectrogram images
 
-    # Generate WAV files and spectrograms
-    generate_spectrograms(mp3_dir, wav_output_dir, spectrogram_output_dir)
\ No newline at end of file
+    # Generate WAV files and spectrograms, listed with their splits in a manifest for the training step
+    generate_spectrograms(mp3_dir, wav_output_dir, spectrogram_output_dir,
+                          manifest_path=os.path.join(spectrogram_output_dir, "manifest.csv"))
\ No newline at end of file
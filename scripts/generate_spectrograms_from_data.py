@@ -1,27 +1,100 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from math import gcd
 import numpy as np
 import pandas as pd
-import librosa
-import matplotlib.pyplot as plt
 from scipy.io.wavfile import write
+from scipy.signal import resample_poly
+from data_segment_splicer import read_bundle_names, read_segment_bundle
+from instrumentation import file_size, track
+from spectrogram_dataset import DatasetManifestWriter, SpectrogramDatasetWriter, recording_name
+from spectrogram_utils import IMAGE_SIZE, Clip, bucket_by_length, save_spectrograms
 
-def csv_to_wav(input_csv, output_wav, sample_rate=44100):
+BUNDLE_EXTENSIONS = (".npz", ".parquet")
+
+# Sampling rate used when a segment has no usable Time column
+DEFAULT_SAMPLE_RATE = 44100
+
+def normalize_current(current):
     """
-    Convert a CSV (Time, Current) file to a WAV file.
+    Normalize Current values to fit in the range [-1, 1]. An all-zero segment stays all zero.
     Args:
-        input_csv (str): Path to the input CSV file.
+        current (np.ndarray): Current values of one segment, or a 2-D array with one segment per row.
+    Returns:
+        np.ndarray: Normalized signal.
+    """
+    current = np.asarray(current, dtype=np.float64)
+    if not current.shape[-1]:
+        return current
+    peaks = np.max(np.abs(current), axis=-1, keepdims=True)
+    return np.divide(current, peaks, out=np.zeros_like(current), where=peaks > 0)
+
+def infer_sample_rate(times, default=DEFAULT_SAMPLE_RATE):
+    """
+    Infer the sampling rate of a segment from the median step of its Time column.
+    Args:
+        times (np.ndarray): Time values of one segment in seconds.
+        default (int): Rate returned when the segment has fewer than two distinct times.
+    Returns:
+        int: Sampling rate in Hz, rounded to the nearest integer as WAV files require.
+    """
+    if times is None or len(times) < 2:
+        return default
+    step = np.median(np.diff(np.asarray(times, dtype=np.float64)))
+    if not np.isfinite(step) or step <= 0:
+        return default
+    return max(1, int(round(1.0 / step)))
+
+def convert_segments(currents, sample_rates, target_rate=None, max_padding=0.25):
+    """
+    Normalize many segments and resample them to a common rate, one padded batch at a time.
+    Segments with the same rate are grouped into length buckets, and each bucket is normalized and
+    resampled with one polyphase filter call. The filter treats the signal as zero beyond its end,
+    so the zero padding does not change the samples kept for each segment.
+    Args:
+        currents (list): Current values of each segment as 1-D np.ndarrays.
+        sample_rates (list): Sampling rate of each segment in Hz.
+        target_rate (int): Rate to resample every segment to, or None to keep each segment's own rate.
+        max_padding (float): Largest allowed padding in a bucket, as a fraction of its shortest segment.
+    Returns:
+        list: (int16 PCM samples, sampling rate) tuples in the same order as currents.
+    """
+    results = [None] * len(currents)
+    groups = {}
+    for i, rate in enumerate(sample_rates):
+        groups.setdefault(int(rate), []).append(i)
+
+    for rate, indices in groups.items():
+        output_rate = int(target_rate) if target_rate else rate
+        divisor = gcd(output_rate, rate)
+        up, down = output_rate // divisor, rate // divisor
+        lengths = [len(currents[i]) for i in indices]
+        for bucket in bucket_by_length(lengths, max_padding):
+            # Pad the bucket into a single 2-D array and normalize every row at once
+            batch = np.zeros((len(bucket), lengths[bucket[-1]]), dtype=np.float64)
+            for row, j in enumerate(bucket):
+                batch[row, :lengths[j]] = currents[indices[j]]
+            batch = normalize_current(batch)
+
+            if up != down and batch.shape[1]:
+                batch = np.clip(resample_poly(batch, up, down, axis=1), -1.0, 1.0)
+
+            # Convert to 16-bit PCM format and cut each row back to its own length, ceil(length * up / down)
+            pcm = np.int16(batch * 32767)
+            for row, j in enumerate(bucket):
+                results[indices[j]] = (pcm[row, :-(-lengths[j] * up // down)], output_rate)
+    return results
+
+def current_to_wav(current, output_wav, sample_rate=DEFAULT_SAMPLE_RATE):
+    """
+    Convert an array of Current values to a WAV file.
+    Args:
+        current (np.ndarray): Current values of one segment.
         output_wav (str): Path to save the WAV file.
         sample_rate (int): Sampling rate for the WAV file.
     """
-    # Read the CSV file
-    data = pd.read_csv(input_csv)
-    if 'Current' not in data.columns:
-        print(f"No 'Current' column in {input_csv}. Skipping.")
-        return
-
     # Normalize the current values to fit in the range [-1, 1]
-    current = data['Current'].values
-    normalized_current = current / np.max(np.abs(current))
+    normalized_current = normalize_current(current)
 
     # Convert to 16-bit PCM format
     pcm_data = np.int16(normalized_current * 32767)
@@ -30,25 +103,177 @@ def csv_to_wav(input_csv, output_wav, sample_rate=44100):
     write(output_wav, sample_rate, pcm_data)
     print(f"WAV file saved: {output_wav}")
 
-def generate_spectrograms(input_csv_dir, wav_output_dir, spectrogram_output_dir, sampling_frequency_override=None):
+def csv_to_wav(input_csv, output_wav, sample_rate=None, target_rate=None):
+    """
+    Convert a CSV (Time, Current) file to a WAV file.
+    Args:
+        input_csv (str): Path to the input CSV file.
+        output_wav (str): Path to save the WAV file.
+        sample_rate (int): Sampling rate of the segment, or None to infer it from the Time column.
+        target_rate (int): Rate to resample the segment to, or None to keep its own rate.
+    """
+    with track("csv_to_wav", input_csv) as item:
+        # Read the CSV file
+        with item.phase("read"):
+            data = pd.read_csv(input_csv)
+        item.add_bytes(read=file_size(input_csv))
+        if 'Current' not in data.columns:
+            print(f"No 'Current' column in {input_csv}. Skipping.")
+            return
+
+        with item.phase("convert"):
+            rate = sample_rate or infer_sample_rate(data['Time'].values if 'Time' in data.columns else None)
+            (pcm_data, output_rate), = convert_segments([data['Current'].values], [rate], target_rate)
+        with item.phase("write"):
+            write(output_wav, output_rate, pcm_data)
+        item.add_bytes(written=file_size(output_wav))
+        print(f"WAV file saved: {output_wav}")
+
+def list_segments(input_dir):
+    """
+    List the segments in a directory of segment CSVs and segment bundles.
+    Args:
+        input_dir (str): Directory containing segment CSV files and/or .npz/.parquet bundles.
+    Returns:
+        generator: Yields (base_name, source_path, segment) tuples. segment is None for CSV files,
+                   and the segment DataFrame for segments read from a bundle.
+    """
+    for f in os.listdir(input_dir):
+        path = os.path.join(input_dir, f)
+        if f.endswith(".csv"):
+            yield os.path.splitext(f)[0], path, None
+        elif f.endswith(BUNDLE_EXTENSIONS):
+            for segment_name, segment in read_segment_bundle(path):
+                yield segment_name, path, segment
+
+def list_segment_names(input_dir):
+    """
+    List the names of the segments in a directory of segment CSVs and segment bundles, without reading the data.
+    """
+    names = []
+    for f in os.listdir(input_dir):
+        if f.endswith(".csv"):
+            names.append(os.path.splitext(f)[0])
+        elif f.endswith(BUNDLE_EXTENSIONS):
+            names.extend(read_bundle_names(os.path.join(input_dir, f)))
+    return names
+
+def csvs_to_wav(input_csv_dir, wav_output_dir, sample_rate=None, target_rate=None, batch_size=256, workers=4):
+    """
+    Convert every segment of a directory to a WAV file, many segments at a time.
+    Each batch of segments is normalized and resampled together with convert_segments, while
+    a thread pool writes the WAV files of the previous batches, so disk I/O overlaps with compute.
+    Args:
+        input_csv_dir (str): Directory containing segment CSV files or segment bundles.
+        wav_output_dir (str): Directory to save the WAV files, named "<segment name>.wav".
+        sample_rate (int): Sampling rate of the segments, or None to infer each one from its Time column.
+        target_rate (int): Rate to resample every segment to, or None to keep each segment's own rate.
+        batch_size (int): Number of segments loaded and converted at once.
+        workers (int): Number of threads reading CSV files and writing WAV files.
+    Returns:
+        dict: Report with the number of "converted" segments and a list of "errors".
+    """
+    os.makedirs(wav_output_dir, exist_ok=True)
+    report = {"converted": 0, "errors": []}
+
+    def load(entry):
+        base_name, source_path, segment = entry
+        if segment is None:
+            segment = pd.read_csv(source_path)
+        if 'Current' not in segment.columns:
+            raise ValueError(f"No 'Current' column in {source_path}")
+        times = segment['Time'].values if 'Time' in segment.columns else None
+        return segment['Current'].values, sample_rate or infer_sample_rate(times)
+
+    def convert_batch(entries, executor):
+        # Read the CSV files of the batch in parallel
+        loaded = []
+        for entry, future in [(entry, executor.submit(load, entry)) for entry in entries]:
+            try:
+                loaded.append((entry[0], *future.result()))
+            except Exception as e:
+                report["errors"].append({"file": entry[0], "error": str(e)})
+                print(f"Error processing {entry[0]} from {entry[1]}: {e}")
+        converted = convert_segments([current for _, current, _ in loaded], [rate for _, _, rate in loaded],
+                                     target_rate)
+        return [(base_name, executor.submit(write, os.path.join(wav_output_dir, f"{base_name}.wav"), rate, pcm_data))
+                for (base_name, _, _), (pcm_data, rate) in zip(loaded, converted)]
+
+    with track("csvs_to_wav", input_csv_dir) as item:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            writes = []
+            entries = []
+            for entry in list_segments(input_csv_dir):
+                entries.append(entry)
+                if len(entries) >= batch_size:
+                    with item.phase("convert"):
+                        writes += convert_batch(entries, executor)
+                    entries = []
+            if entries:
+                with item.phase("convert"):
+                    writes += convert_batch(entries, executor)
+
+            # Wait for the remaining writes
+            with item.phase("write"):
+                for base_name, future in writes:
+                    try:
+                        future.result()
+                        report["converted"] += 1
+                    except Exception as e:
+                        report["errors"].append({"file": base_name, "error": str(e)})
+                        print(f"Error writing {base_name}.wav: {e}")
+
+    print(f"Converted {report['converted']} segments to WAV files in {wav_output_dir}.")
+    return report
+
+def generate_spectrograms(input_csv_dir, wav_output_dir, spectrogram_output_dir, sampling_frequency_override=None,
+                          batch_size=None, image_mode="raster", image_size=IMAGE_SIZE,
+                          dataset_path=None, dataset_format="hdf5", feature_mode=None,
+                          manifest_path=None, shard_dir=None, shard_size=1024, label_names=False):
     """
     Generate spectrograms from CSV files and save them as images in subdirectories based on keywords.
+    The normalized float signal is fed straight into the STFT; WAV files are only written on request.
     Args:
-        input_csv_dir (str): Directory containing input CSV files.
-        wav_output_dir (str): Directory to save WAV files.
+        input_csv_dir (str): Directory containing input CSV files or segment bundles.
+        wav_output_dir (str): Directory to save WAV files, or None to skip writing them.
         spectrogram_output_dir (str): Directory to save spectrogram images.
-        sampling_frequency_override (float): Override for sampling frequency, if desired.
+        sampling_frequency_override (float): Sampling rate of every segment, or None to infer each
+                                             segment's rate from its Time column.
+        batch_size (int): If set, compute the STFTs of this many segments at a time in length-bucketed batches.
+        image_mode (str): "raster" to write fixed-size images directly, "plot" to draw them with matplotlib,
+                          or None to skip images.
+        image_size (tuple): Output (height, width) of raster images and dataset entries in pixels.
+        dataset_path (str): If set, also store every dB spectrogram, resized to image_size, with its label
+                            and source file in a single array store at this path.
+        dataset_format (str): "hdf5" for one .h5 file, or "npy" for a directory with a memory-mappable .npy file.
+        feature_mode (str): "mel" to also save a compact log-mel spectrogram and MFCCs of each clip
+                            as "<name>_features.npz" in the keyword directory. With image_mode=None,
+                            only the features are computed.
+        manifest_path (str): If set, also write a CSV manifest with the path, label, source recording,
+                             bounds, shape and train/val/test split of every spectrogram.
+        shard_dir (str): If set along with manifest_path, also write the resized dB spectrograms to
+                         per-split shards of shard_size entries in this directory, in dataset_format.
+        shard_size (int): Number of spectrograms per shard.
+        label_names (bool): Whether the names start with a label prefix, i.e. the splicers ran with
+                            label_names=True. The prefix is then left out of the manifest's recording names.
     """
-    os.makedirs(wav_output_dir, exist_ok=True)
+    if wav_output_dir is not None:
+        os.makedirs(wav_output_dir, exist_ok=True)
     os.makedirs(spectrogram_output_dir, exist_ok=True)
+    override = int(sampling_frequency_override) if sampling_frequency_override else None
+    pending = []
+    dataset = SpectrogramDatasetWriter(dataset_path, image_size, dataset_format) if dataset_path else None
+    manifest = None
+    if manifest_path:
+        # Splits are cut over all recordings, so list them before the first segment is added
+        recordings = [recording_name(name, name.split('_')[0] if label_names else None)
+                      for name in list_segment_names(input_csv_dir)]
+        manifest = DatasetManifestWriter(manifest_path, image_size, shard_dir, shard_size, dataset_format,
+                                         recordings=recordings)
 
-    # Process each CSV file
-    csv_files = [os.path.join(input_csv_dir, f) for f in os.listdir(input_csv_dir) if f.endswith(".csv")]
-    for csv_file in csv_files:
+    # Process each segment CSV file or bundled segment
+    for base_name, source_path, segment in list_segments(input_csv_dir):
         try:
-            # Extract the base name of the CSV file (without extension)
-            base_name = os.path.splitext(os.path.basename(csv_file))[0]
-
             # Extract the keyword from the file name (e.g., the first part before the underscore)
             keyword = base_name.split('_')[0]
 
@@ -56,45 +281,63 @@ def generate_spectrograms(input_csv_dir, wav_output_dir, spectrogram_output_dir,
             keyword_dir = os.path.join(spectrogram_output_dir, keyword)
             os.makedirs(keyword_dir, exist_ok=True)
 
-            # Create the WAV file name
-            wav_output_path = os.path.join(wav_output_dir, f"{base_name}.wav")
+            # Read the Current values of the segment
+            if segment is None:
+                segment = pd.read_csv(source_path)
+                if 'Current' not in segment.columns:
+                    print(f"No 'Current' column in {source_path}. Skipping.")
+                    continue
+            current = segment['Current'].values
+            # Sampling rate of the segment, inferred from its Time column like csv_to_wav does
+            sr = override or infer_sample_rate(segment['Time'].values if 'Time' in segment.columns else None)
 
-            # Convert CSV to WAV
-            csv_to_wav(csv_file, wav_output_path)
+            # Save the WAV file only if requested
+            if wav_output_dir is not None:
+                current_to_wav(current, os.path.join(wav_output_dir, f"{base_name}.wav"), sr)
 
-            # Load the WAV file for spectrogram generation
-            signal, sr = librosa.load(wav_output_path, sr=None)
+            # Use the normalized signal directly for spectrogram generation
+            signal = normalize_current(current).astype(np.float32)
 
-            # Compute the spectrogram
-            S = librosa.stft(signal, n_fft=2048, hop_length=512)
-            Y = np.abs(S) ** 2
-            Y_log_scale = librosa.power_to_db(Y)
-
-            # Plot the spectrogram
-            plt.figure(figsize=(10, 6))
-            plt.axis('off')  # Hide axes
-            plt.pcolormesh(librosa.times_like(S, sr=sr, hop_length=512),
-                           librosa.fft_frequencies(sr=sr, n_fft=2048),
-                           Y_log_scale, shading='gouraud', cmap='inferno')
-
-            # Save the spectrogram as an image in the keyword directory
+            # Queue the segment; its spectrogram is saved as an image in the keyword directory
             spectrogram_output_path = os.path.join(keyword_dir, f"{base_name}_spectrogram.png")
-            plt.savefig(spectrogram_output_path, bbox_inches='tight', pad_inches=0)
-            plt.close()
-            print(f"Spectrogram saved: {spectrogram_output_path}")
+            # Bounds of the segment in its recording, from its Time column
+            start, end = None, None
+            if 'Time' in segment.columns and len(segment):
+                start, end = float(segment['Time'].iloc[0]), float(segment['Time'].iloc[-1])
+            pending.append(Clip(signal, sr, base_name, keyword, source_path, spectrogram_output_path,
+                                recording_name(base_name, keyword if label_names else None), start, end))
 
         except Exception as e:
-            print(f"Error processing {csv_file}: {e}")
+            print(f"Error processing {base_name} from {source_path}: {e}")
+            continue
+
+        # Compute and save the spectrograms once the batch is full
+        if len(pending) >= (batch_size or 1):
+            save_spectrograms(pending, batched=batch_size is not None,
+                              image_mode=image_mode, image_size=image_size, dataset=dataset,
+                              feature_mode=feature_mode, manifest=manifest)
+            pending = []
+
+    if pending:
+        save_spectrograms(pending, batched=batch_size is not None,
+                          image_mode=image_mode, image_size=image_size, dataset=dataset,
+                          feature_mode=feature_mode, manifest=manifest)
+
+    if dataset is not None:
+        dataset.close()
+    if manifest is not None:
+        manifest.close()
 
 
 if __name__ == "__main__":
     # Directories
     input_csv_dir = "../output/data_segments"  # Directory containing spliced CSV files
-    wav_output_dir = "../output/data_wav_files"  # Directory to save WAV files
+    wav_output_dir = None  # Set to a directory such as "../output/data_wav_files" to also save WAV files
     spectrogram_output_dir = "../output/data_spectrograms"  # Directory to save spectrogram images
 
-    # Create output directories if they don't exist
-    os.makedirs(wav_output_dir, exist_ok=True)
+    # Create the output directory if it doesn't exist
     os.makedirs(spectrogram_output_dir, exist_ok=True)
 
-    generate_spectrograms(input_csv_dir, wav_output_dir, spectrogram_output_dir)
\ No newline at end of file
+    # List the spectrograms with their splits in a manifest for the training step
+    generate_spectrograms(input_csv_dir, wav_output_dir, spectrogram_output_dir,
+                          manifest_path=os.path.join(spectrogram_output_dir, "manifest.csv"))
\ No newline at end of file
@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import numpy as np
+
+# Environment variables that pass the active run to worker processes started with "spawn"
+LOG_ENV_VAR = "SENSOR_RUN_LOG"
+RUN_ENV_VAR = "SENSOR_RUN_ID"
+
+# Run currently being recorded, or None while instrumentation is disabled
+_run = None
+
+
+class _NullItem:
+    """
+    Item returned by track while instrumentation is disabled; every call is a no-op.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def phase(self, name):
+        return self
+
+    def add_bytes(self, read=0, written=0):
+        pass
+
+
+_NULL_ITEM = _NullItem()
+
+
+class _Phase:
+    """
+    Add the wall time of a block to one sub-phase of an item.
+    """
+    __slots__ = ("item", "name", "start")
+
+    def __init__(self, item, name):
+        self.item = item
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        phases = self.item.phases
+        phases[self.name] = phases.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+class _Item:
+    """
+    Wall time, bytes and sub-phase timings of one unit of work, recorded when the block exits.
+    """
+
+    def __init__(self, run, stage, name):
+        self.run = run
+        self.stage = stage
+        self.name = name
+        self.phases = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        self.started = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.run.record({
+            "run": self.run.run_id,
+            "pid": os.getpid(),
+            "stage": self.stage,
+            "item": self.name,
+            "started": self.started,
+            "seconds": time.perf_counter() - self.start,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "phases": self.phases,
+            "error": None if exc_type is None else f"{exc_type.__name__}: {exc_value}",
+        })
+        return False
+
+    def phase(self, name):
+        """
+        Time a sub-phase such as "decode", "stft" or "encode"; repeated phases add up.
+        """
+        return _Phase(self, name)
+
+    def add_bytes(self, read=0, written=0):
+        """
+        Count bytes read from or written to disk by this item.
+        """
+        self.bytes_read += read
+        self.bytes_written += written
+
+
+class _Run:
+    """
+    Records of one run, kept in memory and appended to a JSONL log if one is given.
+    """
+
+    def __init__(self, log_path=None, run_id=None):
+        self.log_path = log_path
+        self.run_id = run_id or f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.records = []
+        # Line buffering writes every record in one call, so processes can share the log
+        self._log = open(log_path, 'a', buffering=1) if log_path else None
+
+    def record(self, entry):
+        self.records.append(entry)
+        if self._log is not None:
+            self._log.write(json.dumps(entry) + "\n")
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+
+
+def start_run(log_path=None):
+    """
+    Start recording per-item timings. Until this is called, track returns a no-op item.
+    Args:
+        log_path (str): Optional JSONL file to append one record per item to. Records of
+                        worker processes only reach the summary through this log.
+    """
+    global _run
+    if _run is not None:
+        stop_run()
+    if log_path:
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+        log_path = os.path.abspath(log_path)
+    _run = _Run(log_path)
+    if log_path:
+        os.environ[LOG_ENV_VAR] = log_path
+        os.environ[RUN_ENV_VAR] = _run.run_id
+
+
+def track(stage, item=None):
+    """
+    Record one unit of work of a stage.
+    Use as "with track(stage, item) as t:", then "with t.phase(name):" around sub-phases
+    and t.add_bytes(read=..., written=...) for disk traffic.
+    Args:
+        stage (str): Name of the stage, e.g. "splice_file".
+        item (str): Name of the item, e.g. the input path.
+    Returns:
+        Context manager that records the item when it exits.
+    """
+    if _run is None:
+        return _NULL_ITEM
+    return _Item(_run, stage, item)
+
+
+def file_size(path):
+    """
+    Return the size of a file in bytes, or 0 if it does not exist.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def load_run_log(log_path, run_id=None):
+    """
+    Read the records of a JSONL run log.
+    Args:
+        log_path (str): Path to the log.
+        run_id (str): Only return the records of this run.
+    Returns:
+        list: Record dicts.
+    """
+    records = []
+    with open(log_path, 'r') as log_file:
+        for line in log_file:
+            if line.strip():
+                entry = json.loads(line)
+                if run_id is None or entry["run"] == run_id:
+                    records.append(entry)
+    return records
+
+
+def summarize(records):
+    """
+    Aggregate records per stage.
+    Args:
+        records (list): Record dicts.
+    Returns:
+        dict: Per stage, the number of items and errors, items per second over the stage's
+              wall-clock span, p50/p95 item latency, bytes read/written and total time per sub-phase.
+    """
+    stages = {}
+    for entry in records:
+        stages.setdefault(entry["stage"], []).append(entry)
+
+    summary = {}
+    for stage, entries in stages.items():
+        seconds = np.array([entry["seconds"] for entry in entries])
+        first_start = min(entry["started"] for entry in entries)
+        span = max(entry["started"] + entry["seconds"] for entry in entries) - first_start
+        phases = {}
+        for entry in entries:
+            for name, value in entry["phases"].items():
+                phases[name] = phases.get(name, 0.0) + value
+        summary[stage] = {
+            "items": len(entries),
+            "errors": sum(entry["error"] is not None for entry in entries),
+            "items_per_second": len(entries) / span if span > 0 else None,
+            "p50": float(np.percentile(seconds, 50)),
+            "p95": float(np.percentile(seconds, 95)),
+            "bytes_read": sum(entry["bytes_read"] for entry in entries),
+            "bytes_written": sum(entry["bytes_written"] for entry in entries),
+            "phases": phases,
+        }
+    return summary
+
+
+def print_summary(summary):
+    """
+    Print one line per stage and the share of each sub-phase.
+    """
+    for stage, stats in summary.items():
+        rate = f"{stats['items_per_second']:.2f} items/s" if stats["items_per_second"] else "n/a items/s"
+        print(f"{stage}: {stats['items']} items ({stats['errors']} errors), {rate}, "
+              f"p50 {stats['p50'] * 1000:.1f} ms, p95 {stats['p95'] * 1000:.1f} ms, "
+              f"read {stats['bytes_read'] / 2 ** 20:.1f} MB, written {stats['bytes_written'] / 2 ** 20:.1f} MB")
+        total = sum(stats["phases"].values())
+        for name, value in sorted(stats["phases"].items(), key=lambda phase: -phase[1]):
+            print(f"    {name}: {value:.3f} s ({100 * value / max(total, 1e-12):.0f}%)")
+
+
+def stop_run():
+    """
+    Stop recording and print the end-of-run summary.
+    Returns:
+        dict: The summary from summarize, or None if no run was active.
+    """
+    global _run
+    if _run is None:
+        return None
+    run, _run = _run, None
+    run.close()
+    os.environ.pop(LOG_ENV_VAR, None)
+    os.environ.pop(RUN_ENV_VAR, None)
+
+    records = load_run_log(run.log_path, run.run_id) if run.log_path else run.records
+    summary = summarize(records)
+    print_summary(summary)
+    return summary
+
+
+# Worker processes started with "spawn" re-import this module and pick the run up from the environment
+if os.environ.get(LOG_ENV_VAR) and os.environ.get(RUN_ENV_VAR):
+    _run = _Run(os.environ[LOG_ENV_VAR], os.environ[RUN_ENV_VAR])
@@ -0,0 +1,493 @@
+import os
+import time
+import queue
+import socket
+import threading
+from collections import namedtuple
+import librosa
+import numpy as np
+import pandas as pd
+import scipy.fft
+from data_segment_splicer import parse_data_block, save_segment_to_csv, segment_name
+from instrumentation import track
+from spectrogram_utils import IMAGE_SIZE, save_spectrogram_image
+
+# A segment cut from the live stream. spectrogram is None unless the segmenter computes one.
+LiveSegment = namedtuple("LiveSegment", ["name", "label", "start", "end", "data", "spectrogram", "latency"])
+
+
+class RingBuffer:
+    """
+    Fixed-capacity buffer of the most recent rows of a stream, readable as one contiguous array.
+    Rows are written into an array twice the capacity; when it fills up, the newest rows are
+    moved back to the front, so appending costs O(1) amortized and view never copies.
+    """
+
+    def __init__(self, capacity, row_shape=(), dtype=np.float64):
+        self.capacity = capacity
+        self._data = np.empty((2 * capacity,) + tuple(row_shape), dtype=dtype)
+        self._stop = 0
+        self.total = 0  # Rows appended since the buffer was created
+
+    def append(self, rows):
+        """
+        Append rows, evicting the oldest ones beyond the capacity.
+        """
+        self.total += len(rows)
+        rows = rows[-self.capacity:]
+        if self._stop + len(rows) > len(self._data):
+            keep = min(self._stop, self.capacity - len(rows))
+            self._data[:keep] = self._data[self._stop - keep:self._stop]
+            self._stop = keep
+        self._data[self._stop:self._stop + len(rows)] = rows
+        self._stop += len(rows)
+
+    def view(self):
+        """
+        Return the buffered rows, oldest first. The view is only valid until the next append.
+        """
+        return self._data[max(0, self._stop - self.capacity):self._stop]
+
+
+class IncrementalSTFT:
+    """
+    Short-time Fourier transform of a stream, computed one hop at a time as samples arrive.
+    Frame k covers samples [k * hop_size, k * hop_size + frame_size) of the stream with a Hann
+    window, like librosa.stft without centering, so no frame is computed twice.
+    """
+
+    def __init__(self, frame_size=2048, hop_size=512):
+        self.frame_size = frame_size
+        self.hop_size = hop_size
+        self.window = librosa.filters.get_window("hann", frame_size, fftbins=True)
+        self._times = np.empty(0)
+        self._samples = np.empty(0)
+
+    def push(self, times, samples):
+        """
+        Add samples to the stream and compute every frame they complete.
+        Args:
+            times (np.ndarray): Time of each sample.
+            samples (np.ndarray): Sample values.
+        Returns:
+            tuple: float32 power frames of shape (n, 1 + frame_size // 2) and the (first, last)
+                   sample time of each frame, of shape (n, 2).
+        """
+        times = np.concatenate([self._times, times])
+        samples = np.concatenate([self._samples, samples])
+        n = 0 if len(samples) < self.frame_size else 1 + (len(samples) - self.frame_size) // self.hop_size
+
+        if n:
+            frames = np.lib.stride_tricks.sliding_window_view(samples, self.frame_size)[::self.hop_size][:n]
+            power = (np.abs(scipy.fft.rfft(frames * self.window, axis=1)) ** 2).astype(np.float32)
+            starts = np.arange(n) * self.hop_size
+            frame_times = np.stack([times[starts], times[starts + self.frame_size - 1]], axis=1)
+        else:
+            power = np.empty((0, 1 + self.frame_size // 2), dtype=np.float32)
+            frame_times = np.empty((0, 2))
+
+        # Keep the samples the next frame starts with
+        self._times = times[n * self.hop_size:]
+        self._samples = samples[n * self.hop_size:]
+        return power, frame_times
+
+
+class LiveSegmenter:
+    """
+    Cut keyword segments out of a live (Time, Current) stream as timestamp events arrive.
+    The most recent samples are kept in a ring buffer sized to the longest segment plus padding and
+    the largest delay of an event behind the stream. A segment is emitted by the push or add_event
+    call that makes it complete, i.e. as soon as the stream has passed its padded end time, with the
+    same bounds as data_segment_splicer.segment_bounds. Segments are numbered in emission order.
+    """
+
+    def __init__(self, name="live", padding_before=0.2, padding_after=0.2, offset=0.35, max_segment=2.0,
+                 max_delay=2.0, sample_rate=None, spectrogram=False, frame_size=2048, hop_size=512):
+        """
+        Args:
+            name (str): Base name of the segments, like the .data file name in process_data_file.
+            padding_before (float): Padding to add before the start of each segment in seconds.
+            padding_after (float): Padding to add after the end of each segment in seconds.
+            offset (float): Offset to apply to all timestamps in seconds.
+            max_segment (float): Longest timestamp range to keep samples for, in seconds.
+            max_delay (float): How far behind the stream an event may arrive, in seconds.
+                               Events whose start has already left the ring buffer are dropped.
+            sample_rate (float): Sampling rate of the stream in Hz. Inferred from the Time column if None.
+            spectrogram (bool): Whether to run an incremental STFT over the stream and attach the
+                                frames of each segment to it. A segment shorter than frame_size
+                                samples gets an array with no frames.
+            frame_size (int): Frame size for STFT.
+            hop_size (int): Hop size for STFT.
+        """
+        self.name = name
+        self.padding_before = padding_before
+        self.padding_after = padding_after
+        self.offset = offset
+        self.max_segment = max_segment
+        self.max_delay = max_delay
+        self.sample_rate = sample_rate
+        self.stft = IncrementalSTFT(frame_size, hop_size) if spectrogram else None
+
+        self.samples = None  # Ring buffer of (Time, Current) rows, created with the first samples
+        self.frame_power = None
+        self.frame_times = None
+        self.pending = []  # Events waiting for the stream to pass their end
+        self.last_time = -np.inf
+        self.segment_number = 0
+        self.dropped = 0
+        self._head = np.empty((2, 0))
+
+    def _allocate(self, block):
+        """
+        Size the ring buffers once the sampling rate is known.
+        """
+        if self.sample_rate is None:
+            self.sample_rate = 1.0 / np.median(np.diff(block[0]))
+        span = self.max_segment + self.padding_before + self.padding_after + self.max_delay
+        capacity = int(np.ceil(span * self.sample_rate))
+        self.samples = RingBuffer(capacity, (2,))
+        if self.stft is not None:
+            frames = capacity // self.stft.hop_size + 1
+            self.frame_power = RingBuffer(frames, (1 + self.stft.frame_size // 2,), np.float32)
+            self.frame_times = RingBuffer(frames, (2,))
+
+    def add_event(self, start, end, label=None):
+        """
+        Add a timestamp range of the stream.
+        Args:
+            start (float): Start time in seconds.
+            end (float): End time in seconds.
+            label (str): Optional keyword label, used as a prefix of the segment name.
+        Returns:
+            list: LiveSegments that are complete.
+        """
+        # Apply offset and padding
+        start_time = max(0, start + self.offset - self.padding_before)
+        end_time = end + self.offset + self.padding_after
+        self.pending.append((start_time, end_time, label, time.perf_counter()))
+        return self._emit(final=False)
+
+    def push(self, block):
+        """
+        Add samples of the stream.
+        Args:
+            block (np.ndarray): Array of shape (2, n) holding consecutive Time and Current rows,
+                                as yielded by the sources of this module.
+        Returns:
+            list: LiveSegments that are complete.
+        """
+        if not block.shape[1]:
+            return []
+        times = block[0]
+        if times[0] < self.last_time or np.any(times[1:] < times[:-1]):
+            raise ValueError("Time column of the stream is not sorted; live segmentation needs ascending times")
+
+        if self.samples is None:
+            # Wait for two samples to infer the sampling rate
+            block = np.concatenate([self._head, block], axis=1)
+            if self.sample_rate is None and block.shape[1] < 2:
+                self._head = block
+                return []
+            self._allocate(block)
+        self.last_time = block[0, -1]
+
+        self.samples.append(block.T)
+        if self.stft is not None:
+            power, frame_times = self.stft.push(block[0], block[1])
+            self.frame_power.append(power)
+            self.frame_times.append(frame_times)
+        return self._emit(final=False)
+
+    def flush(self):
+        """
+        End the stream; every pending event is cut from the samples received so far.
+        Returns:
+            list: The remaining LiveSegments.
+        """
+        return self._emit(final=True)
+
+    def _emit(self, final):
+        ready = []
+        waiting = []
+        for event in self.pending:
+            (ready if final or self.last_time > event[1] else waiting).append(event)
+        if not ready:
+            return []
+        self.pending = waiting
+
+        segments = []
+        rows = self.samples.view() if self.samples is not None else np.empty((0, 2))
+        for start_time, end_time, label, added in ready:
+            # The start of the range was evicted before the event arrived
+            if self.samples is not None and self.samples.total > self.samples.capacity and start_time < rows[0, 0]:
+                print(f"Event {start_time:.3f}-{end_time:.3f} starts before the ring buffer. Dropping.")
+                self.dropped += 1
+                continue
+
+            lo = np.searchsorted(rows[:, 0], start_time, side="left")
+            hi = np.searchsorted(rows[:, 0], end_time, side="right")
+            if hi <= lo:
+                continue
+            data = pd.DataFrame({"Time": rows[lo:hi, 0].copy(), "Current": rows[lo:hi, 1].copy()})
+
+            spectrogram = None
+            if self.stft is not None:
+                frame_times = self.frame_times.view()
+                inside = (frame_times[:, 0] >= start_time) & (frame_times[:, 1] <= end_time)
+                power = self.frame_power.view()[inside].T
+
+                if power.shape[1]:
+                    # Scale as if the segment had been normalized to [-1, 1] like the offline spectrograms
+                    peak = np.max(np.abs(data["Current"].to_numpy()))
+                    spectrogram = librosa.power_to_db(power / peak ** 2 if peak > 0 else power)
+                else:
+                    # The segment is shorter than one frame; it gets an empty spectrogram
+                    spectrogram = power
+
+            name = segment_name(self.name, self.segment_number, label)
+            self.segment_number += 1
+            segments.append(LiveSegment(name, label, start_time, end_time, data, spectrogram,
+                                        time.perf_counter() - added))
+        return segments
+
+
+def read_stream(stream, block_lines=256, skip_header=True):
+    """
+    Read (Time, Current) rows from a text stream such as sys.stdin or a socket file.
+    Args:
+        stream (file): Text stream with one "time current" row per line.
+        block_lines (int): Number of rows per block. Smaller blocks lower the latency.
+        skip_header (bool): Whether the stream starts with a .data header ending in "***End_of_Header***".
+    Returns:
+        generator: Yields arrays of shape (2, n) holding consecutive Time and Current rows.
+    """
+    in_header = skip_header
+    lines = []
+    for line in stream:
+        if in_header:
+            in_header = "***End_of_Header***" not in line
+            continue
+        lines.append(line)
+        if len(lines) >= block_lines:
+            yield parse_data_block(lines)
+            lines = []
+    if lines:
+        yield parse_data_block(lines)
+
+
+def read_socket(host, port, block_lines=256, skip_header=False):
+    """
+    Read (Time, Current) rows sent as text lines over a TCP connection.
+    Args:
+        host (str): Host of the sensor logger.
+        port (int): TCP port of the sensor logger.
+        block_lines (int): Number of rows per block.
+        skip_header (bool): Whether the logger sends a .data header first.
+    Returns:
+        generator: Yields arrays of shape (2, n) holding consecutive Time and Current rows.
+    """
+    with socket.create_connection((host, port)) as connection:
+        with connection.makefile("r") as stream:
+            yield from read_stream(stream, block_lines, skip_header)
+
+
+def tail_file(path, block_lines=256, poll_interval=0.05, idle_timeout=None, skip_header=True):
+    """
+    Follow a .data file while a logger appends to it, like "tail -f".
+    When no new rows are available an empty block is yielded before waiting, so the caller
+    can handle timestamp events in the meantime. A line is only parsed once it is complete.
+    Args:
+        path (str): Path to the .data file.
+        block_lines (int): Largest number of rows per block.
+        poll_interval (float): Seconds to wait for new data.
+        idle_timeout (float): Stop after this many seconds without new data, or never if None.
+        skip_header (bool): Whether the file starts with a header ending in "***End_of_Header***".
+    Returns:
+        generator: Yields arrays of shape (2, n) holding consecutive Time and Current rows.
+    """
+    in_header = skip_header
+    partial = ""
+    lines = []
+    last_data = time.monotonic()
+    with open(path, "r") as read_file:
+        while True:
+            line = read_file.readline()
+            if line:
+                partial += line
+                if not partial.endswith("\n"):
+                    continue  # The logger is still writing this line
+                line, partial = partial, ""
+                last_data = time.monotonic()
+                if in_header:
+                    in_header = "***End_of_Header***" not in line
+                    continue
+                lines.append(line)
+                if len(lines) >= block_lines:
+                    yield parse_data_block(lines)
+                    lines = []
+                continue
+
+            # No more data for now
+            if lines:
+                yield parse_data_block(lines)
+                lines = []
+                continue
+            if idle_timeout is not None and time.monotonic() - last_data > idle_timeout:
+                return
+            yield np.empty((2, 0))
+            time.sleep(poll_interval)
+
+
+def synthetic_source(duration=10.0, sample_rate=1000, block_size=100, bursts=(), noise=0.01, realtime=False, seed=0):
+    """
+    Generate a synthetic (Time, Current) stream for testing without a sensor.
+    Args:
+        duration (float): Length of the stream in seconds.
+        sample_rate (int): Sampling rate in Hz.
+        block_size (int): Number of rows per block.
+        bursts (list): (start, end) times in seconds where a 50 Hz burst is added to the noise.
+        noise (float): Standard deviation of the Gaussian noise.
+        realtime (bool): Whether to pace the blocks at the rate a live sensor would deliver them.
+        seed (int): Seed of the noise generator.
+    Returns:
+        generator: Yields arrays of shape (2, n) holding consecutive Time and Current rows.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(duration * sample_rate)
+    started = time.monotonic()
+    for first in range(0, total, block_size):
+        times = np.arange(first, min(first + block_size, total)) / sample_rate
+        current = rng.normal(0, noise, len(times))
+        for start, end in bursts:
+            inside = (times >= start) & (times <= end)
+            current[inside] += np.sin(2 * np.pi * 50 * times[inside])
+        if realtime:
+            time.sleep(max(0.0, started + times[-1] - time.monotonic()))
+        yield np.stack([times, current])
+
+
+def parse_event(line):
+    """
+    Parse a timestamp event line, "start:end" or "label,start:end".
+    Returns:
+        tuple: (start, end, label), with label None if the line has none.
+    """
+    label, _, timestamps = line.strip().rpartition(",")
+    start, end = map(float, timestamps.split(":"))
+    return start, end, label or None
+
+
+def follow_events(path, events, stop, poll_interval=0.05):
+    """
+    Follow a file of timestamp event lines and put each event on a queue; meant to run in a thread.
+    Args:
+        path (str): Path to the event file, e.g. written by a live transcription.
+        events (queue.Queue): Queue receiving (start, end, label) tuples.
+        stop (threading.Event): Set to stop following the file.
+        poll_interval (float): Seconds to wait for new lines.
+    """
+    while not os.path.exists(path) and not stop.is_set():
+        time.sleep(poll_interval)
+    partial = ""
+    with open(path, "r") as read_file:
+        while not stop.is_set():
+            line = read_file.readline()
+            if not line:
+                time.sleep(poll_interval)
+                continue
+            partial += line
+            if not partial.endswith("\n"):
+                continue
+            line, partial = partial, ""
+            if not line.strip():
+                continue
+            try:
+                events.put(parse_event(line))
+            except ValueError:
+                print(f"Invalid timestamp format: {line.strip()}. Skipping.")
+
+
+def run_live(source, output_dir, events=None, name="live", padding_before=0.2, padding_after=0.2, offset=0.35,
+             max_segment=2.0, max_delay=2.0, sample_rate=None, spectrogram_dir=None, frame_size=2048, hop_size=512,
+             image_size=IMAGE_SIZE):
+    """
+    Segment a live stream and save each segment as soon as it is complete.
+    Args:
+        source (iterable): Blocks of (Time, Current) rows, e.g. from tail_file, read_stream or synthetic_source.
+        output_dir (str): Directory for the segment CSV files, named like process_data_file names them.
+        events (queue.Queue): Queue of (start, end, label) timestamp events, checked before every block.
+        name (str): Base name of the segments.
+        padding_before (float): Padding to add before the start of each segment in seconds.
+        padding_after (float): Padding to add after the end of each segment in seconds.
+        offset (float): Offset to apply to all timestamps in seconds.
+        max_segment (float): Longest timestamp range to keep samples for, in seconds.
+        max_delay (float): How far behind the stream an event may arrive, in seconds.
+        sample_rate (float): Sampling rate of the stream in Hz. Inferred from the Time column if None.
+        spectrogram_dir (str): If set, also save a spectrogram image of each segment from the
+                               incremental STFT, in a subdirectory per keyword.
+        frame_size (int): Frame size for STFT.
+        hop_size (int): Hop size for STFT.
+        image_size (tuple): Output (height, width) of the spectrogram images in pixels.
+    Returns:
+        dict: Report with the number of "segments" saved, events "dropped" for arriving too late,
+              and the "max_latency" in seconds between an event arriving and its segment being saved.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    segmenter = LiveSegmenter(name, padding_before, padding_after, offset, max_segment, max_delay, sample_rate,
+                              spectrogram_dir is not None, frame_size, hop_size)
+    report = {"segments": 0, "dropped": 0, "max_latency": 0.0}
+
+    def save(segments):
+        for segment in segments:
+            with track("live_segment", segment.name) as item:
+                with item.phase("write"):
+                    prefix, segment_number = segment.name.rsplit("_", 1)
+                    save_segment_to_csv(segment.data, output_dir, prefix, segment_number)
+                if spectrogram_dir is not None and not segment.spectrogram.shape[1]:
+                    print(f"Segment {segment.name} is shorter than one STFT frame. Skipping its spectrogram.")
+                elif spectrogram_dir is not None:
+                    keyword_dir = os.path.join(spectrogram_dir, segment.name.split('_')[0])
+                    os.makedirs(keyword_dir, exist_ok=True)
+                    with item.phase("image"):
+                        save_spectrogram_image(segment.spectrogram,
+                                               os.path.join(keyword_dir, f"{segment.name}_spectrogram.png"),
+                                               image_size)
+            report["segments"] += 1
+            report["max_latency"] = max(report["max_latency"], segment.latency)
+
+    def drain():
+        while events is not None:
+            try:
+                start, end, label = events.get_nowait()
+            except queue.Empty:
+                return
+            save(segmenter.add_event(start, end, label))
+
+    for block in source:
+        drain()
+        save(segmenter.push(block))
+    drain()
+    save(segmenter.flush())
+
+    report["dropped"] = segmenter.dropped
+    print(f"Saved {report['segments']} live segments, dropped {report['dropped']} late events.")
+    return report
+
+
+if __name__ == "__main__":
+    # A logger appends samples to the .data file and a live transcription appends "label,start:end" lines
+    # to the event file. Use synthetic_source(..., realtime=True) as the source to try it without a sensor.
+    data_path = "../data/live/session.data"
+    events_path = "../data/live/events.txt"
+    output_dir = "../output/live_segments"
+    spectrogram_dir = "../output/live_spectrograms"
+
+    events = queue.Queue()
+    stop = threading.Event()
+    follower = threading.Thread(target=follow_events, args=(events_path, events, stop), daemon=True)
+    follower.start()
+    try:
+        run_live(tail_file(data_path, idle_timeout=10.0), output_dir, events,
+                 name=os.path.splitext(os.path.basename(data_path))[0], spectrogram_dir=spectrogram_dir)
+    finally:
+        stop.set()
@@ -0,0 +1,439 @@
+import os
+import json
+import hashlib
+from collections import namedtuple
+import pandas as pd
+from instrumentation import start_run, stop_run, track
+
+# Default locations, matching the paths hard-coded in each script
+DEFAULT_PATHS = {
+    "audio_dir": "../data/audio_clips",  # Recordings (.m4a sources and converted .mp3 files)
+    "media_dir": "../data/audio_clips",  # Recordings to transcribe
+    "timestamps_csv": "../data/timestamps.csv",  # CSV file with filenames and timestamp ranges
+    "data_dir": "../data/data_segments",  # Directory containing the .data files
+    "offsets_csv": None,  # Optional per-file offsets from sensor_alignment
+    "transcripts_dir": "../output/transcripts",
+    "word_clips_dir": "../output/clips",
+    "audio_clips_dir": "../output/audio_clips",
+    "audio_spectrograms_dir": "../output/audio_spectrograms",
+    "data_segments_dir": "../output/data_segments",
+    "data_spectrograms_dir": "../output/data_spectrograms",
+    "manifest": "../output/pipeline_manifest.json",
+}
+
+# Default parameters; every artifact records the ones its stage depends on
+DEFAULT_PARAMS = {
+    "convert_format": "mp3",  # "flac" or "wav" to convert the .m4a recordings losslessly
+    "model_name": "tiny",
+    "chunk_seconds": None,  # Transcribe in overlapping windows of this many seconds, for long recordings
+    "padding_before": 0.2,
+    "padding_after": 0.2,
+    "offset": 0.35,
+    "frame_size": 2048,
+    "hop_size": 512,
+    "image_mode": "raster",
+    "image_size": [227, 227],
+}
+
+# Stages in dependency order: each stage only reads files written by the stages before it
+#   convert -> transcribe -> word_clips
+#   convert -> audio_splice -> audio_spectrograms
+#   data_splice -> data_spectrograms
+STAGES = ["convert", "transcribe", "word_clips", "audio_splice", "audio_spectrograms",
+          "data_splice", "data_spectrograms"]
+
+# One unit of work: a key unique across the pipeline, the files it reads, the parameters
+# it depends on, and a function that builds it and returns the list of files it wrote
+Task = namedtuple("Task", ["key", "inputs", "params", "run"])
+
+
+def load_manifest(path):
+    """
+    Load the pipeline manifest, or start an empty one.
+    Args:
+        path (str): Path to the manifest JSON file.
+    Returns:
+        dict: Manifest with "artifacts" (per task key) and "hashes" (per input file).
+    """
+    if os.path.exists(path):
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    return {"artifacts": {}, "hashes": {}}
+
+
+def save_manifest(manifest, path):
+    """
+    Write the pipeline manifest atomically.
+    Args:
+        manifest (dict): Manifest to save.
+        path (str): Path to the manifest JSON file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as json_file:
+        json.dump(manifest, json_file, indent=2)
+    os.replace(temp_path, path)
+
+
+def file_digest(path, manifest):
+    """
+    Hash a file's content, reusing the manifest's hash when its size and modification time are unchanged.
+    Args:
+        path (str): Path to the file.
+        manifest (dict): Pipeline manifest holding the hash cache.
+    Returns:
+        str: SHA-256 hex digest of the file content.
+    """
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    cached = manifest["hashes"].get(key)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    manifest["hashes"][key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+    return digest.hexdigest()
+
+
+def task_fingerprint(task, manifest):
+    """
+    Combine the content hashes of a task's inputs with its parameters.
+    """
+    inputs = {path: file_digest(path, manifest) for path in task.inputs}
+    payload = json.dumps({"inputs": inputs, "params": task.params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def remove_outputs(paths):
+    """
+    Delete output files left behind by an artifact that was rebuilt or dropped.
+    """
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def stage_outputs(manifest, stage):
+    """
+    List the files written by every artifact of a stage.
+    """
+    outputs = []
+    for key, artifact in manifest["artifacts"].items():
+        if key.split(":", 1)[0] == stage:
+            outputs.extend(artifact["outputs"])
+    return outputs
+
+
+def convert_tasks(paths, params, manifest):
+    from convert_m4a_to_mp3 import OUTPUT_FORMATS, convert_file
+
+    output_format = params["convert_format"]
+    tasks = []
+    for filename in sorted(os.listdir(paths["audio_dir"])):
+        if filename.lower().endswith(".m4a"):
+            input_path = os.path.join(paths["audio_dir"], filename)
+            output_filename = os.path.splitext(filename)[0] + OUTPUT_FORMATS[output_format]
+            output_path = os.path.join(paths["audio_dir"], output_filename)
+            tasks.append(Task(f"convert:{filename}", [input_path], {"convert_format": output_format},
+                              lambda i=input_path, o=output_path: convert_file(i, o, output_format) or [o]))
+    return tasks
+
+
+def transcribe_tasks(paths, params, manifest):
+    from transcript_clipper import supported_extensions
+
+    # One transcript per base name, preferring extensions in supported_extensions order
+    media = {}
+    for filename in sorted(os.listdir(paths["media_dir"])):
+        base_name, ext = os.path.splitext(filename)
+        if ext.lower() in supported_extensions:
+            current = media.get(base_name)
+            if current is None or supported_extensions.index(ext.lower()) < supported_extensions.index(current[1]):
+                media[base_name] = (filename, ext.lower())
+
+    def transcribe(input_path, output_path):
+        import transcript_generator
+
+        if transcript_generator.model is None:
+            transcript_generator.load_worker_model(params["model_name"])
+        if params.get("chunk_seconds"):
+            transcript_generator.transcribe_file_chunked(input_path, output_path, params["chunk_seconds"])
+        else:
+            transcript_generator.transcribe_file(input_path, output_path)
+        return [output_path]
+
+    # Whole-file transcripts keep the parameters they were built with before chunking existed
+    task_params = {"model_name": params["model_name"]}
+    if params.get("chunk_seconds"):
+        task_params["chunk_seconds"] = params["chunk_seconds"]
+
+    tasks = []
+    for base_name, (filename, _) in sorted(media.items()):
+        input_path = os.path.join(paths["media_dir"], filename)
+        output_path = os.path.join(paths["transcripts_dir"], f"{base_name}_transcript.json")
+        tasks.append(Task(f"transcribe:{filename}", [input_path], task_params,
+                          lambda i=input_path, o=output_path: transcribe(i, o)))
+    return tasks
+
+
+def word_clips_tasks(paths, params, manifest):
+    from transcript_clipper import (audio_extensions, clip_audio_words, clip_video_words, find_media_file,
+                                    load_words, video_extensions, word_clip_path)
+
+    def clip(transcript_path, media_file, media_filename):
+        words = load_words(transcript_path)
+        if media_file.lower().endswith(video_extensions):
+            clip_video_words(media_file, words, paths["word_clips_dir"], media_filename)
+            extension = ".mp4"
+        elif media_file.lower().endswith(audio_extensions):
+            clip_audio_words(media_file, words, paths["word_clips_dir"], media_filename)
+            extension = ".mp3"
+        else:
+            return []
+        outputs = [word_clip_path(paths["word_clips_dir"], media_filename, idx, word_info, extension)
+                   for idx, word_info in enumerate(words)]
+        return [path for path in outputs if os.path.exists(path)]
+
+    tasks = []
+    for transcript_path in stage_outputs(manifest, "transcribe"):
+        if not os.path.exists(transcript_path):
+            continue
+        media_filename = os.path.basename(transcript_path).replace('_transcript.json', '')
+        media_file = find_media_file(paths["media_dir"], media_filename)
+        if media_file is None:
+            continue
+        tasks.append(Task(f"word_clips:{media_filename}", [transcript_path, media_file], {},
+                          lambda t=transcript_path, m=media_file, n=media_filename: clip(t, m, n)))
+    return tasks
+
+
+def file_ranges(paths):
+    """
+    Parse the timestamp ranges of every file in the timestamps CSV.
+    """
+    from timestamps import index_timestamps, load_timestamps
+
+    table, invalid = load_timestamps(paths["timestamps_csv"])
+    for cell in invalid:
+        print(f"{cell['file']}: Invalid timestamp format in column {cell['label']}: {cell['value']}")
+    return {file: [(start, end) for _, start, end in ranges] for file, ranges in index_timestamps(table).items()}
+
+
+def audio_splice_tasks(paths, params, manifest):
+    from audio_clip_splicer import clip_filename, find_source_file, splice_file
+
+    def splice(input_path, base_filename, ranges):
+        _, errors = splice_file(input_path, paths["audio_clips_dir"], base_filename, ranges)
+        for error in errors:
+            print(f"Error processing {error['output'] or error['file']}: {error['error']}")
+        outputs = [os.path.join(paths["audio_clips_dir"], clip_filename(base_filename, start, end))
+                   for start, end in ranges]
+        return [path for path in outputs if os.path.exists(path)]
+
+    tasks = []
+    for base_filename, ranges in file_ranges(paths).items():
+        input_path = find_source_file(paths["audio_dir"], base_filename)
+        if not os.path.exists(input_path):
+            continue
+        # Only this file's row of the timestamps CSV is part of its fingerprint
+        tasks.append(Task(f"audio_splice:{base_filename}", [input_path], {"ranges": ranges},
+                          lambda i=input_path, b=base_filename, r=ranges: splice(i, b, r)))
+    return tasks
+
+
+def audio_spectrograms_tasks(paths, params, manifest):
+    from pydub import AudioSegment
+    from generate_spectrograms_from_audio import audio_to_signal
+    from spectrogram_utils import Clip, save_spectrograms
+
+    stage_params = {key: params[key] for key in ("frame_size", "hop_size", "image_mode", "image_size")}
+
+    def render(clip_path):
+        base_name = os.path.splitext(os.path.basename(clip_path))[0]
+        keyword = base_name.split('_')[0]
+        keyword_dir = os.path.join(paths["audio_spectrograms_dir"], keyword)
+        os.makedirs(keyword_dir, exist_ok=True)
+        output_path = os.path.join(keyword_dir, f"{base_name}_spectrogram.png")
+        # Clips are read a single time, so they bypass the decoded-audio cache
+        signal, sr = audio_to_signal(AudioSegment.from_file(clip_path))
+        save_spectrograms([Clip(signal, sr, base_name, keyword, clip_path, output_path)],
+                          params["frame_size"], params["hop_size"], image_mode=params["image_mode"],
+                          image_size=tuple(params["image_size"]))
+        return [output_path] if os.path.exists(output_path) else []
+
+    return [Task(f"audio_spectrograms:{os.path.basename(clip_path)}", [clip_path], stage_params,
+                 lambda c=clip_path: render(c))
+            for clip_path in stage_outputs(manifest, "audio_splice") if os.path.exists(clip_path)]
+
+
+def data_splice_tasks(paths, params, manifest):
+    from data_segment_splicer import extract_segments, save_segment_to_csv
+
+    file_offsets = {}
+    if paths["offsets_csv"] is not None:
+        offsets_data = pd.read_csv(paths["offsets_csv"])
+        file_offsets = {row.File: (row.offset, row.drift) for row in offsets_data.itertuples(index=False)}
+
+    def splice(filepath, filename, ranges, offset):
+        segments = extract_segments(filepath, ranges, params["padding_before"], params["padding_after"], offset)
+        outputs = []
+        for segment_number, (_, segment) in enumerate(segments):
+            save_segment_to_csv(segment, paths["data_segments_dir"], filename, segment_number)
+            outputs.append(os.path.join(paths["data_segments_dir"], f"{filename}_{segment_number}.csv"))
+        return outputs
+
+    tasks = []
+    all_ranges = file_ranges(paths)
+    for filename in sorted(os.listdir(paths["data_dir"])):
+        file_name_no_ext = os.path.splitext(filename)[0]
+        if not filename.endswith(".data") or file_name_no_ext not in all_ranges:
+            continue
+        filepath = os.path.join(paths["data_dir"], filename)
+
+        # Use the estimated offset of this file; a drift scales the audio timestamps
+        ranges = all_ranges[file_name_no_ext]
+        offset = params["offset"]
+        if file_name_no_ext in file_offsets:
+            offset, drift = file_offsets[file_name_no_ext]
+            ranges = [(start * (1 + drift), end * (1 + drift)) for start, end in ranges]
+
+        stage_params = {"ranges": ranges, "offset": offset, "padding_before": params["padding_before"],
+                        "padding_after": params["padding_after"]}
+        tasks.append(Task(f"data_splice:{file_name_no_ext}", [filepath], stage_params,
+                          lambda f=filepath, n=file_name_no_ext, r=ranges, o=offset: splice(f, n, r, o)))
+    return tasks
+
+
+def data_spectrograms_tasks(paths, params, manifest):
+    import numpy as np
+    from generate_spectrograms_from_data import infer_sample_rate, normalize_current
+    from spectrogram_utils import Clip, save_spectrograms
+
+    stage_params = {key: params[key] for key in ("image_mode", "image_size")}
+
+    def render(segment_path):
+        base_name = os.path.splitext(os.path.basename(segment_path))[0]
+        keyword = base_name.split('_')[0]
+        keyword_dir = os.path.join(paths["data_spectrograms_dir"], keyword)
+        os.makedirs(keyword_dir, exist_ok=True)
+        output_path = os.path.join(keyword_dir, f"{base_name}_spectrogram.png")
+        segment = pd.read_csv(segment_path)
+        signal = normalize_current(segment['Current'].values).astype(np.float32)
+        sr = infer_sample_rate(segment['Time'].values if 'Time' in segment.columns else None)
+        save_spectrograms([Clip(signal, sr, base_name, keyword, segment_path, output_path)],
+                          image_mode=params["image_mode"], image_size=tuple(params["image_size"]))
+        return [output_path] if os.path.exists(output_path) else []
+
+    return [Task(f"data_spectrograms:{os.path.basename(segment_path)}", [segment_path], stage_params,
+                 lambda s=segment_path: render(s))
+            for segment_path in stage_outputs(manifest, "data_splice") if os.path.exists(segment_path)]
+
+
+STAGE_TASKS = {
+    "convert": convert_tasks,
+    "transcribe": transcribe_tasks,
+    "word_clips": word_clips_tasks,
+    "audio_splice": audio_splice_tasks,
+    "audio_spectrograms": audio_spectrograms_tasks,
+    "data_splice": data_splice_tasks,
+    "data_spectrograms": data_spectrograms_tasks,
+}
+
+STAGE_OUTPUT_DIRS = {
+    "convert": "audio_dir",
+    "transcribe": "transcripts_dir",
+    "word_clips": "word_clips_dir",
+    "audio_splice": "audio_clips_dir",
+    "audio_spectrograms": "audio_spectrograms_dir",
+    "data_splice": "data_segments_dir",
+    "data_spectrograms": "data_spectrograms_dir",
+}
+
+
+def run_pipeline(paths=None, params=None, stages=None, force=False):
+    """
+    Run the pipeline stages in dependency order, rebuilding only artifacts whose inputs or parameters changed.
+    Every artifact is recorded in a manifest with the content hashes of its inputs, the parameters
+    it depends on, and the files it wrote. An artifact is rebuilt when that fingerprint changes or
+    one of its files is missing; artifacts whose source disappeared have their files removed.
+    Args:
+        paths (dict): Overrides for DEFAULT_PATHS.
+        params (dict): Overrides for DEFAULT_PARAMS.
+        stages (list): Names of the stages to run, in STAGES order. Defaults to all of them.
+        force (bool): Rebuild every artifact of the selected stages.
+    Returns:
+        dict: Number of rebuilt, up-to-date and failed artifacts per stage.
+    """
+    paths = {**DEFAULT_PATHS, **(paths or {})}
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    manifest = load_manifest(paths["manifest"])
+    summary = {}
+
+    for stage in STAGES:
+        if stages is not None and stage not in stages:
+            continue
+        os.makedirs(paths[STAGE_OUTPUT_DIRS[stage]], exist_ok=True)
+        tasks = STAGE_TASKS[stage](paths, params, manifest)
+
+        # Drop the artifacts whose source is gone
+        current_keys = {task.key for task in tasks}
+        for key in [key for key in manifest["artifacts"] if key.split(":", 1)[0] == stage]:
+            if key not in current_keys:
+                remove_outputs(manifest["artifacts"].pop(key)["outputs"])
+
+        rebuilt, failed = 0, 0
+        for task in tasks:
+            try:
+                fingerprint = task_fingerprint(task, manifest)
+            except OSError as e:
+                print(f"Error reading inputs of {task.key}: {e}")
+                failed += 1
+                continue
+            artifact = manifest["artifacts"].get(task.key)
+            if (not force and artifact is not None and artifact["fingerprint"] == fingerprint
+                    and all(os.path.exists(path) for path in artifact["outputs"])):
+                continue
+
+            print(f"Building {task.key}")
+            try:
+                with track(f"pipeline.{stage}", task.key):
+                    outputs = task.run()
+            except Exception as e:
+                print(f"Error building {task.key}: {e}")
+                failed += 1
+                continue
+
+            # Remove files the previous build wrote that this build no longer produces
+            if artifact is not None:
+                remove_outputs(set(artifact["outputs"]) - set(outputs))
+            manifest["artifacts"][task.key] = {
+                "fingerprint": fingerprint,
+                "inputs": task.inputs,
+                "params": task.params,
+                "outputs": outputs,
+            }
+            rebuilt += 1
+
+            # Save progress so an interrupted run keeps the artifacts it already built
+            save_manifest(manifest, paths["manifest"])
+
+        save_manifest(manifest, paths["manifest"])
+        up_to_date = len(tasks) - rebuilt - failed
+        summary[stage] = {"rebuilt": rebuilt, "up_to_date": up_to_date, "failed": failed}
+        print(f"{stage}: {rebuilt} rebuilt, {up_to_date} up to date, {failed} failed")
+
+    return summary
+
+
+if __name__ == "__main__":
+    # Record per-item timings to this JSONL log and print a summary at the end; set to None to disable
+    run_log = "../output/run_log.jsonl"
+
+    # Run every stage with the default directories and parameters
+    if run_log:
+        start_run(run_log)
+    run_pipeline()
+    stop_run()
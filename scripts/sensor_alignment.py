@@ -0,0 +1,175 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy.signal import correlate, correlation_lags
+from audio_cache import load_pcm
+from data_segment_splicer import load_data_file
+
+# List of supported audio file extensions
+audio_extensions = ('.mp3', '.wav', '.flac', '.m4a')
+
+# Rate the audio is decoded at for alignment; far above the envelope rate, and small enough that
+# an hour of mono 16-bit audio takes about 60 MB
+ALIGNMENT_SAMPLE_RATE = 8000
+
+
+def audio_envelope(pcm, sample_rate, rate=100):
+    """
+    Compute the RMS envelope of mono audio.
+    Args:
+        pcm (np.ndarray): Mono 16-bit samples, e.g. from audio_cache.load_pcm.
+        sample_rate (int): Sampling rate of the samples in Hz.
+        rate (int): Envelope sampling rate in Hz.
+    Returns:
+        np.ndarray: Envelope with one value per 1 / rate seconds, starting at time 0.
+    """
+    bin_size = max(1, int(sample_rate // rate))
+    bins = len(pcm) // bin_size
+    frames = np.asarray(pcm[:bins * bin_size], dtype=np.float32).reshape(bins, bin_size) / 32768.0
+    return np.sqrt(np.square(frames).mean(axis=1))
+
+
+def sensor_envelope(times, current, rate=100):
+    """
+    Compute the activity envelope of a sensor trace as the standard deviation of Current per time bin.
+    Args:
+        times (np.ndarray): Time column of the trace in seconds.
+        current (np.ndarray): Current column of the trace.
+        rate (int): Envelope sampling rate in Hz.
+    Returns:
+        np.ndarray: Envelope with one value per 1 / rate seconds, starting at time 0.
+    """
+    valid = times >= 0
+    bins = np.floor(times[valid] * rate).astype(np.int64)
+    values = current[valid]
+    counts = np.bincount(bins)
+    sums = np.bincount(bins, weights=values, minlength=len(counts))
+    squares = np.bincount(bins, weights=values ** 2, minlength=len(counts))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = sums / counts
+        variance = squares / counts - mean ** 2
+    return np.sqrt(np.clip(np.nan_to_num(variance), 0, None))
+
+
+def _standardize(envelope):
+    """
+    Scale an envelope to zero mean and unit variance.
+    """
+    std = envelope.std()
+    return (envelope - envelope.mean()) / std if std > 0 else envelope - envelope.mean()
+
+
+def estimate_lag(reference, delayed, rate=100, max_lag=5.0, center=0.0):
+    """
+    Estimate how far one envelope lags behind another with FFT-based cross-correlation.
+    Args:
+        reference (np.ndarray): Envelope of the reference signal (audio).
+        delayed (np.ndarray): Envelope of the signal that lags behind it (sensor).
+        rate (int): Sampling rate of both envelopes in Hz.
+        max_lag (float): Largest lag to consider, in seconds either side of center.
+        center (float): Expected lag in seconds.
+    Returns:
+        tuple: The lag in seconds (positive when delayed trails reference) and the
+               peak correlation normalized by the length of the reference.
+    """
+    correlation = correlate(_standardize(delayed), _standardize(reference), mode="full", method="fft")
+    lags = correlation_lags(len(delayed), len(reference), mode="full")
+    window = np.abs(lags - center * rate) <= max_lag * rate
+    if not np.any(window):
+        raise ValueError("No lag within max_lag of center")
+    best = np.flatnonzero(window)[np.argmax(correlation[window])]
+    return lags[best] / rate, correlation[best] / len(reference)
+
+
+def estimate_offset(pcm, sample_rate, times, current, rate=100, max_lag=5.0, drift_windows=0):
+    """
+    Estimate the offset between an audio recording and its sensor trace.
+    The offset follows the convention of process_data_file: a time t in the audio is
+    found at t + offset + drift * t in the sensor trace.
+    Args:
+        pcm (np.ndarray): Mono 16-bit samples of the audio recording.
+        sample_rate (int): Sampling rate of the samples in Hz.
+        times (np.ndarray): Time column of the sensor trace.
+        current (np.ndarray): Current column of the sensor trace.
+        rate (int): Envelope sampling rate in Hz.
+        max_lag (float): Largest offset to consider in seconds.
+        drift_windows (int): If at least 2, also estimate a linear drift by fitting the lags
+                             of this many consecutive windows of the audio.
+    Returns:
+        dict: "offset" and "drift" in seconds per second, and the correlation "score".
+    """
+    reference = audio_envelope(pcm, sample_rate, rate)
+    delayed = sensor_envelope(times, current, rate)
+    offset, score = estimate_lag(reference, delayed, rate, max_lag)
+    drift = 0.0
+
+    if drift_windows >= 2:
+        # Refine the lag of each audio window around the global lag and fit a line through them
+        window_size = len(reference) // drift_windows
+        centers, lags = [], []
+        for w in range(drift_windows):
+            window = reference[w * window_size:(w + 1) * window_size]
+            lag, _ = estimate_lag(window, delayed, rate, max_lag=1.0, center=offset + w * window_size / rate)
+            centers.append((w + 0.5) * window_size / rate)
+            lags.append(lag - w * window_size / rate)
+        drift, offset = np.polyfit(centers, lags, 1)
+
+    return {"offset": float(offset), "drift": float(drift), "score": float(score)}
+
+
+def align_files(audio_directory, data_directory, output_csv, rate=100, max_lag=5.0, drift_windows=0):
+    """
+    Estimate the audio-to-sensor offset of every .data file that has a matching audio file,
+    and save them to a table that process_all_files can read with offsets_csv.
+    Args:
+        audio_directory (str): Directory containing the audio recordings.
+        data_directory (str): Directory containing the .data files.
+        output_csv (str): Path to save the offsets table (File, offset, drift, score).
+        rate (int): Envelope sampling rate in Hz.
+        max_lag (float): Largest offset to consider in seconds.
+        drift_windows (int): Number of windows used to estimate a linear drift, or 0 to skip it.
+    Returns:
+        pd.DataFrame: The offsets table.
+    """
+    rows = []
+    for filename in sorted(os.listdir(data_directory)):
+        if not filename.endswith(".data"):
+            continue
+        file_name_no_ext = os.path.splitext(filename)[0]
+
+        # Find the corresponding audio file
+        audio_path = None
+        for ext in audio_extensions:
+            possible_audio_path = os.path.join(audio_directory, file_name_no_ext + ext)
+            if os.path.isfile(possible_audio_path):
+                audio_path = possible_audio_path
+                break
+        if audio_path is None:
+            print(f"No audio file found for {filename}. Skipping.")
+            continue
+
+        try:
+            df = load_data_file(os.path.join(data_directory, filename))
+            # Decode mono at a low rate; ffmpeg downmixes and resamples without a full-rate copy in memory
+            pcm = load_pcm(audio_path, ALIGNMENT_SAMPLE_RATE)
+            result = estimate_offset(pcm, ALIGNMENT_SAMPLE_RATE, df["Time"].to_numpy(), df["Current"].to_numpy(),
+                                     rate, max_lag, drift_windows)
+            rows.append({"File": file_name_no_ext, **result})
+            print(f"{file_name_no_ext}: offset {result['offset']:.3f} s, drift {result['drift']:.2e}, "
+                  f"score {result['score']:.3f}")
+        except Exception as e:
+            print(f"Error aligning {filename}: {e}")
+
+    offsets = pd.DataFrame(rows, columns=["File", "offset", "drift", "score"])
+    offsets.to_csv(output_csv, index=False)
+    print(f"Offsets saved to {output_csv}")
+    return offsets
+
+
+if __name__ == "__main__":
+    # Define input directories and the offsets table
+    audio_dir = "../data/audio_clips"  # Directory containing the audio recordings
+    data_dir = "../data/data_segments"  # Directory containing your .data files
+    offsets_csv = "../data/offsets.csv"  # Table of per-file offsets for data_segment_splicer
+
+    align_files(audio_dir, data_dir, offsets_csv)
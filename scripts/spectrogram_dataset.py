@@ -0,0 +1,337 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+
+METADATA_COLUMNS = ["name", "label", "source"]
+
+# Columns of the dataset manifest. "path" is relative to the manifest, and "shard"/"index" locate
+# the entry in the shards, if any; both are empty when the entry was not written there.
+MANIFEST_COLUMNS = ["path", "name", "label", "recording", "source", "start", "end", "height", "width",
+                    "split", "shard", "index"]
+
+# Split names and fractions, the same 70/10/20 split train_new_sensor_model.m makes with splitEachLabel
+SPLITS = (("train", 0.7), ("val", 0.1), ("test", 0.2))
+
+# Bytes reserved for the .npy header so the final shape can be written in place
+NPY_HEADER_SIZE = 128
+
+
+def _npy_header(shape, dtype):
+    """
+    Build a version 1.0 .npy header padded to NPY_HEADER_SIZE bytes.
+    """
+    header = repr({"descr": np.dtype(dtype).str, "fortran_order": False, "shape": tuple(shape)})
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+class SpectrogramDatasetWriter:
+    """
+    Append fixed-size float32 spectrograms and their metadata to a single array store.
+    With dataset_format="hdf5" the output is one HDF5 file with a chunked "spectrograms"
+    dataset of shape (N, height, width) and "name", "label" and "source" string datasets,
+    readable with h5py or MATLAB's h5read. With dataset_format="npy" the output is a
+    directory holding spectrograms.npy, which np.load can memory-map, and metadata.csv.
+    """
+
+    def __init__(self, output_path, image_size, dataset_format="hdf5"):
+        """
+        Args:
+            output_path (str): Path to the .h5 file, or to the directory for the "npy" format.
+            image_size (tuple): (height, width) of each stored spectrogram.
+            dataset_format (str): Either "hdf5" or "npy".
+        """
+        self.output_path = output_path
+        self.image_size = tuple(image_size)
+        self.dataset_format = dataset_format
+        self.metadata = []
+
+        if dataset_format == "hdf5":
+            import h5py
+
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            self._file = h5py.File(output_path, "w")
+            self._spectrograms = self._file.create_dataset(
+                "spectrograms", shape=(0, *self.image_size), maxshape=(None, *self.image_size),
+                dtype="float32", chunks=(1, *self.image_size))
+        elif dataset_format == "npy":
+            os.makedirs(output_path, exist_ok=True)
+            self._file = open(os.path.join(output_path, "spectrograms.npy"), "wb")
+            self._file.write(_npy_header((0, *self.image_size), np.float32))
+        else:
+            raise ValueError(f"Unsupported dataset format: {dataset_format}")
+
+    def add(self, spectrogram, name, label, source):
+        """
+        Append one spectrogram to the store.
+        Args:
+            spectrogram (np.ndarray): Array of shape image_size.
+            name (str): Base name of the clip or segment.
+            label (str): Keyword label.
+            source (str): Path of the file the clip or segment came from.
+        """
+        spectrogram = np.asarray(spectrogram, dtype=np.float32)
+        if self.dataset_format == "hdf5":
+            index = len(self.metadata)
+            self._spectrograms.resize(index + 1, axis=0)
+            self._spectrograms[index] = spectrogram
+        else:
+            self._file.write(np.ascontiguousarray(spectrogram).tobytes())
+        self.metadata.append((name, label, source))
+
+    def close(self):
+        """
+        Write the metadata and finalize the store.
+        """
+        columns = list(zip(*self.metadata)) or [[], [], []]
+        if self.dataset_format == "hdf5":
+            import h5py
+
+            for column, values in zip(METADATA_COLUMNS, columns):
+                self._file.create_dataset(column, data=list(values), dtype=h5py.string_dtype())
+            self._file.close()
+        else:
+            # Rewrite the header with the final number of spectrograms
+            self._file.seek(0)
+            self._file.write(_npy_header((len(self.metadata), *self.image_size), np.float32))
+            self._file.close()
+            pd.DataFrame(self.metadata, columns=METADATA_COLUMNS).to_csv(
+                os.path.join(self.output_path, "metadata.csv"), index=False)
+        print(f"{len(self.metadata)} spectrograms saved to {self.output_path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_spectrogram_dataset(path):
+    """
+    Open a store written by SpectrogramDatasetWriter.
+    Args:
+        path (str): Path to the .h5 file or the "npy" dataset directory.
+    Returns:
+        tuple: The spectrograms (an h5py dataset, or a read-only np.memmap) and a
+               pd.DataFrame with "name", "label" and "source" columns.
+               For HDF5 the file stays open as long as the dataset is referenced.
+    """
+    if os.path.isdir(path):
+        spectrograms = np.load(os.path.join(path, "spectrograms.npy"), mmap_mode="r")
+        metadata = pd.read_csv(os.path.join(path, "metadata.csv"), dtype=str, keep_default_na=False)
+        return spectrograms, metadata
+
+    import h5py
+
+    dataset_file = h5py.File(path, "r")
+    metadata = pd.DataFrame({column: dataset_file[column].asstr()[:] for column in METADATA_COLUMNS})
+    return dataset_file["spectrograms"], metadata
+
+
+def recording_name(name, label=None):
+    """
+    Recover the source recording of a clip or segment from its name.
+    Names are "<recording>_<suffix>", or "<label>_<recording>_<suffix>" when the splicers ran with
+    label_names=True, where the suffix is the segment number of a data segment or the "<start>-<end>"
+    range of an audio clip. Whether a name has a label prefix cannot be told from the name itself,
+    since recording names may contain underscores, so the caller has to say so.
+    Args:
+        name (str): Base name of the clip or segment.
+        label (str): Label prefix of the name, or None if the name has none.
+    Returns:
+        str: Name of the source recording.
+    """
+    if label is not None and name.startswith(f"{label}_"):
+        name = name[len(label) + 1:]
+    return name.rsplit("_", 1)[0]
+
+
+def assign_splits(recordings, splits=SPLITS, seed=0):
+    """
+    Assign recordings to splits by sorting them on a hash of their names and cutting the order at the
+    split fractions. Every clip of a recording lands in the same split, and with at least as many
+    recordings as splits, every split gets at least one recording.
+    Args:
+        recordings (iterable): Names of the source recordings.
+        splits (tuple): (name, fraction) pairs whose fractions add up to 1.
+        seed (int): Changes the order the recordings are cut in.
+    Returns:
+        dict: Name of the split of each recording.
+    """
+    def order(recording):
+        return hashlib.sha256(f"{seed}:{recording}".encode("utf-8")).digest()
+
+    ordered = sorted(set(recordings), key=order)
+
+    # Round the cumulative fractions so the counts add up to the number of recordings
+    counts, cumulative, cut = [], 0.0, 0
+    for _, fraction in splits:
+        cumulative += fraction
+        next_cut = min(int(cumulative * len(ordered) + 0.5), len(ordered))
+        counts.append(next_cut - cut)
+        cut = next_cut
+    counts[-1] += len(ordered) - cut
+    if len(ordered) >= len(splits):
+        # Move recordings from the largest split into the empty ones
+        for i, count in enumerate(counts):
+            if count == 0:
+                counts[counts.index(max(counts))] -= 1
+                counts[i] = 1
+
+    assignment = {}
+    for (split, _), count in zip(splits, counts):
+        for recording in ordered[len(assignment):len(assignment) + count]:
+            assignment[recording] = split
+    return assignment
+
+
+class ShardedDatasetWriter:
+    """
+    Write fixed-size spectrograms to a series of stores of shard_size entries each, one series per split.
+    Shards are SpectrogramDatasetWriter stores named "<split>-<number>.h5" (or "<split>-<number>"
+    directories for the "npy" format), so a training job can stream each split with sequential reads.
+    """
+
+    def __init__(self, output_dir, image_size, shard_size=1024, dataset_format="hdf5"):
+        """
+        Args:
+            output_dir (str): Directory for the shards.
+            image_size (tuple): (height, width) of each stored spectrogram.
+            shard_size (int): Number of spectrograms per shard; only the last shard of a split is smaller.
+            dataset_format (str): Either "hdf5" or "npy".
+        """
+        self.output_dir = output_dir
+        self.image_size = tuple(image_size)
+        self.shard_size = shard_size
+        self.dataset_format = dataset_format
+        self._writers = {}  # Open shard of each split
+        self._counts = {}  # Shards started for each split
+        os.makedirs(output_dir, exist_ok=True)
+
+    def add(self, spectrogram, name, label, source, split):
+        """
+        Append one spectrogram to the current shard of its split.
+        Returns:
+            tuple: File name of the shard and the index of the spectrogram in it.
+        """
+        writer = self._writers.get(split)
+        if writer is not None and len(writer.metadata) >= self.shard_size:
+            writer.close()
+            writer = None
+        if writer is None:
+            number = self._counts.get(split, 0)
+            self._counts[split] = number + 1
+            shard = f"{split}-{number:05d}" + (".h5" if self.dataset_format == "hdf5" else "")
+            writer = SpectrogramDatasetWriter(os.path.join(self.output_dir, shard), self.image_size,
+                                              self.dataset_format)
+            self._writers[split] = writer
+        index = len(writer.metadata)
+        writer.add(spectrogram, name, label, source)
+        return os.path.basename(writer.output_path), index
+
+    def close(self):
+        """
+        Finalize the open shard of every split.
+        """
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+
+class DatasetManifestWriter:
+    """
+    Collect one row per generated spectrogram into a CSV manifest, so a training job can list its
+    files, labels and splits without scanning the keyword directories. Splits are assigned per
+    source recording with assign_splits, over the recordings given up front or, without them, over
+    the recordings added by the time the manifest is closed. With a shard directory, the resized dB
+    spectrograms are also written to per-split ShardedDatasetWriter shards referenced by the "shard"
+    and "index" columns; the shards need the recordings up front, since a split is known when a clip is added.
+    """
+
+    def __init__(self, output_path, image_size, shard_dir=None, shard_size=1024, dataset_format="hdf5",
+                 splits=SPLITS, seed=0, recordings=None):
+        """
+        Args:
+            output_path (str): Path to the manifest CSV file.
+            image_size (tuple): (height, width) of the spectrograms stored in the shards.
+            shard_dir (str): Directory for the shards, or None to only write the manifest.
+            shard_size (int): Number of spectrograms per shard.
+            dataset_format (str): Format of the shards, either "hdf5" or "npy".
+            splits (tuple): (name, fraction) pairs passed to assign_splits.
+            seed (int): Seed passed to assign_splits.
+            recordings (iterable): Every source recording that clips will be added from, or None.
+        """
+        if shard_dir and recordings is None:
+            raise ValueError("Writing shards requires the list of recordings")
+        self.output_path = output_path
+        self.splits = splits
+        self.seed = seed
+        self.assignment = assign_splits(recordings, splits, seed) if recordings is not None else None
+        self.rows = []
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        self.shards = ShardedDatasetWriter(shard_dir, image_size, shard_size, dataset_format) if shard_dir else None
+
+    def add(self, clip, path, shape=None, spectrogram=None):
+        """
+        Add the row of one clip or segment.
+        Args:
+            clip (Clip): The clip, whose recording, start and end are used when set. Without a recording,
+                         the name is assumed to have no label prefix.
+            path (str): Path of the file written for the clip, or None.
+            shape (tuple): (height, width) of that file's spectrogram, or None if unknown.
+            spectrogram (np.ndarray): Resized dB spectrogram to write to the shards, or None.
+        """
+        recording = clip.recording or recording_name(clip.name)
+        split = None
+        if self.assignment is not None:
+            if recording not in self.assignment:
+                raise ValueError(f"Recording {recording} of {clip.name} is not in the list of recordings")
+            split = self.assignment[recording]
+        shard, index = None, None
+        if self.shards is not None and spectrogram is not None:
+            shard, index = self.shards.add(spectrogram, clip.name, clip.label, clip.source, split)
+
+        manifest_dir = os.path.dirname(os.path.abspath(self.output_path))
+        relative_path = os.path.relpath(os.path.abspath(path), manifest_dir).replace(os.sep, "/") if path else None
+        height, width = shape if shape is not None else (None, None)
+        self.rows.append((relative_path, clip.name, clip.label, recording, clip.source, clip.start, clip.end,
+                          height, width, split, shard, index))
+
+    def close(self):
+        """
+        Write the manifest and finalize the shards.
+        """
+        if self.shards is not None:
+            self.shards.close()
+        manifest = pd.DataFrame(self.rows, columns=MANIFEST_COLUMNS)
+        if self.assignment is None:
+            manifest["split"] = manifest["recording"].map(assign_splits(manifest["recording"], self.splits, self.seed))
+        for column in ("height", "width", "index"):
+            manifest[column] = manifest[column].astype("Int64")
+        manifest.to_csv(self.output_path, index=False)
+        print(f"{len(self.rows)} entries saved to {self.output_path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_manifest(path, split=None):
+    """
+    Read a manifest written by DatasetManifestWriter.
+    Args:
+        path (str): Path to the manifest CSV file.
+        split (str): Only return the rows of this split.
+    Returns:
+        pd.DataFrame: One row per spectrogram, with MANIFEST_COLUMNS.
+    """
+    manifest = pd.read_csv(path, dtype={"path": str, "name": str, "label": str, "recording": str,
+                                        "source": str, "split": str, "shard": str})
+    for column in ("height", "width", "index"):
+        manifest[column] = manifest[column].astype("Int64")
+    if split is not None:
+        manifest = manifest[manifest["split"] == split].reset_index(drop=True)
+    return manifest
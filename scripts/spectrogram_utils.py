@@ -0,0 +1,304 @@
+import os
+from collections import namedtuple
+import librosa
+import numpy as np
+import scipy.fft
+from matplotlib import colormaps
+from matplotlib.image import imsave
+from instrumentation import file_size, track
+
+# Input size of the AlexNet model in train_new_sensor_model.m
+IMAGE_SIZE = (227, 227)
+
+# 256-entry RGB lookup table of the inferno colormap
+INFERNO_LUT = (colormaps['inferno'](np.linspace(0, 1, 256))[:, :3] * 255).round().astype(np.uint8)
+
+# A clip or segment queued for spectrogram generation. recording, start and end locate it in its
+# source recording for the dataset manifest, when known.
+Clip = namedtuple("Clip", ["signal", "sr", "name", "label", "source", "output_path", "recording", "start", "end"],
+                  defaults=(None, None, None))
+
+# Settings of the compact log-mel/MFCC features; every clip is resized to FEATURE_FRAMES frames
+FEATURE_FRAME_SIZE = 512
+FEATURE_HOP_SIZE = 128
+N_MELS = 64
+N_MFCC = 20
+FEATURE_FRAMES = 64
+
+# Mel filterbanks already built, keyed by (sr, n_fft, n_mels)
+_mel_filterbanks = {}
+
+
+def compute_spectrogram(signal, frame_size=2048, hop_size=512):
+    """
+    Compute the log-scaled power spectrogram of a single signal.
+    Args:
+        signal (np.ndarray): Audio or sensor signal.
+        frame_size (int): Frame size for STFT.
+        hop_size (int): Hop size for STFT.
+    Returns:
+        np.ndarray: Spectrogram in dB with shape (1 + frame_size // 2, frames).
+    """
+    S = librosa.stft(signal, n_fft=frame_size, hop_length=hop_size)
+    Y = np.abs(S) ** 2
+    return librosa.power_to_db(Y)
+
+
+def mel_filterbank(sr, n_fft=FEATURE_FRAME_SIZE, n_mels=N_MELS):
+    """
+    Return the mel filterbank for a sampling rate and FFT size, building it only once per process.
+    Args:
+        sr (int): Sampling rate in Hz.
+        n_fft (int): FFT size.
+        n_mels (int): Number of mel bands.
+    Returns:
+        np.ndarray: float32 filterbank of shape (n_mels, 1 + n_fft // 2).
+    """
+    key = (sr, n_fft, n_mels)
+    if key not in _mel_filterbanks:
+        _mel_filterbanks[key] = librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels).astype(np.float32)
+    return _mel_filterbanks[key]
+
+
+def compute_features(signal, sr, frame_size=FEATURE_FRAME_SIZE, hop_size=FEATURE_HOP_SIZE, n_mels=N_MELS,
+                     n_mfcc=N_MFCC, frames=FEATURE_FRAMES):
+    """
+    Compute a fixed-size log-mel spectrogram and MFCCs of a single signal.
+    The MFCCs are the DCT of the log-mel bands, as librosa.feature.mfcc computes them.
+    Args:
+        signal (np.ndarray): Audio or sensor signal.
+        sr (int): Sampling rate of the signal in Hz.
+        frame_size (int): Frame size for STFT.
+        hop_size (int): Hop size for STFT.
+        n_mels (int): Number of mel bands.
+        n_mfcc (int): Number of MFCCs.
+        frames (int): Number of frames each feature is resized to.
+    Returns:
+        tuple: float32 log-mel spectrogram in dB of shape (n_mels, frames) and MFCCs of shape (n_mfcc, frames).
+    """
+    S = librosa.stft(signal, n_fft=frame_size, hop_length=hop_size)
+    mel = mel_filterbank(sr, frame_size, n_mels) @ (np.abs(S) ** 2)
+    log_mel = librosa.power_to_db(mel)
+    mfcc = scipy.fft.dct(log_mel, axis=0, type=2, norm="ortho")[:n_mfcc]
+    return (resize_linear(log_mel, (n_mels, frames)).astype(np.float32),
+            resize_linear(mfcc, (n_mfcc, frames)).astype(np.float32))
+
+
+def features_path(output_path):
+    """
+    Build the path of a clip's feature file next to its spectrogram image.
+    """
+    root = os.path.splitext(output_path)[0]
+    if root.endswith("_spectrogram"):
+        root = root[:-len("_spectrogram")]
+    return f"{root}_features.npz"
+
+
+def save_features(log_mel, mfcc, output_path):
+    """
+    Save the features of one clip as an uncompressed .npz file with "log_mel" and "mfcc" arrays.
+    """
+    np.savez(output_path, log_mel=log_mel, mfcc=mfcc)
+
+
+def load_features(path):
+    """
+    Load the features saved by save_features.
+    Returns:
+        tuple: The log-mel spectrogram and the MFCCs.
+    """
+    with np.load(path) as features:
+        return features["log_mel"], features["mfcc"]
+
+
+def bucket_by_length(lengths, max_padding=0.25):
+    """
+    Group signals of similar length so they can be padded into one batch.
+    Args:
+        lengths (list): Length of each signal in samples.
+        max_padding (float): Largest allowed padding in a bucket, as a fraction of its shortest signal.
+    Returns:
+        list: Buckets of signal indices, each sorted by length.
+    """
+    order = np.argsort(lengths, kind="stable")
+    buckets = []
+    for i in order:
+        if buckets and lengths[i] <= lengths[buckets[-1][0]] * (1 + max_padding):
+            buckets[-1].append(int(i))
+        else:
+            buckets.append([int(i)])
+    return buckets
+
+
+def compute_spectrograms_batched(signals, frame_size=2048, hop_size=512, max_padding=0.25, top_db=80.0):
+    """
+    Compute the log-scaled power spectrograms of many signals with one STFT call per length bucket.
+    Each bucket is zero-padded into a 2-D array. Since the STFT is centered with zero padding,
+    the first 1 + len // hop_size frames of a padded signal equal those of the unpadded one, so
+    the results are cut back per signal and match compute_spectrogram. The dB conversion applies
+    the top_db floor per signal, like librosa.power_to_db does for a single spectrogram.
+    Args:
+        signals (list): Signals as 1-D np.ndarrays of the same dtype.
+        frame_size (int): Frame size for STFT.
+        hop_size (int): Hop size for STFT.
+        max_padding (float): Largest allowed padding in a bucket, as a fraction of its shortest signal.
+        top_db (float): Dynamic range of each spectrogram in dB.
+    Returns:
+        list: Spectrograms in dB, in the same order as signals.
+    """
+    lengths = [len(signal) for signal in signals]
+    spectrograms = [None] * len(signals)
+    for bucket in bucket_by_length(lengths, max_padding):
+        # Pad the bucket into a single 2-D array
+        batch = np.zeros((len(bucket), lengths[bucket[-1]]), dtype=signals[bucket[0]].dtype)
+        for row, i in enumerate(bucket):
+            batch[row, :lengths[i]] = signals[i]
+
+        # Compute the STFT and power of the whole bucket at once
+        S = librosa.stft(batch, n_fft=frame_size, hop_length=hop_size)
+        Y = np.abs(S) ** 2
+
+        # Mask the frames that only exist because of the padding
+        frames = np.array([1 + lengths[i] // hop_size for i in bucket])
+        valid = np.arange(Y.shape[-1]) < frames[:, None]
+
+        # Convert to dB with each signal's own peak as the top_db reference
+        Y_log_scale = librosa.power_to_db(Y, top_db=None)
+        peaks = np.where(valid[:, None, :], Y_log_scale, -np.inf).max(axis=(1, 2))
+        Y_log_scale = np.maximum(Y_log_scale, (peaks - top_db)[:, None, None])
+
+        for row, i in enumerate(bucket):
+            spectrograms[i] = Y_log_scale[row, :, :frames[row]]
+    return spectrograms
+
+
+def save_spectrogram_plot(Y_log_scale, sr, output_path, frame_size=2048, hop_size=512):
+    """
+    Plot a spectrogram with matplotlib and save it as an image without axes.
+    Args:
+        Y_log_scale (np.ndarray): Spectrogram in dB.
+        sr (int): Sampling rate of the signal.
+        output_path (str): Path to save the image.
+        frame_size (int): Frame size used for the STFT.
+        hop_size (int): Hop size used for the STFT.
+    """
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10, 6))
+    plt.axis('off')  # Hide axes
+    plt.pcolormesh(librosa.times_like(Y_log_scale, sr=sr, hop_length=hop_size),
+                   librosa.fft_frequencies(sr=sr, n_fft=frame_size),
+                   Y_log_scale, shading='gouraud', cmap='inferno')
+    plt.savefig(output_path, bbox_inches='tight', pad_inches=0)
+    plt.close()
+
+
+def resize_linear(Y, shape):
+    """
+    Resize a 2-D array with bilinear interpolation between its corner samples.
+    Args:
+        Y (np.ndarray): Array to resize.
+        shape (tuple): Output (height, width).
+    Returns:
+        np.ndarray: Resized array.
+    """
+    def axis_weights(size, out_size):
+        positions = np.linspace(0, size - 1, out_size)
+        lower = np.floor(positions).astype(int)
+        upper = np.minimum(lower + 1, size - 1)
+        return lower, upper, positions - lower
+
+    r0, r1, wr = axis_weights(Y.shape[0], shape[0])
+    c0, c1, wc = axis_weights(Y.shape[1], shape[1])
+    top = Y[r0][:, c0] * (1 - wc) + Y[r0][:, c1] * wc
+    bottom = Y[r1][:, c0] * (1 - wc) + Y[r1][:, c1] * wc
+    return top * (1 - wr[:, None]) + bottom * wr[:, None]
+
+
+def save_spectrogram_image(Y_log_scale, output_path, image_size=IMAGE_SIZE):
+    """
+    Render a spectrogram straight to a fixed-size PNG without creating a matplotlib figure.
+    The dB values are resized, scaled to their own min/max range like pcolormesh does, and
+    mapped through the inferno colormap, with low frequencies at the bottom of the image.
+    Args:
+        Y_log_scale (np.ndarray): Spectrogram in dB.
+        output_path (str): Path to save the image.
+        image_size (tuple): Output (height, width) in pixels.
+    """
+    resized = resize_linear(Y_log_scale[::-1].astype(np.float32), image_size)
+    low, high = resized.min(), resized.max()
+    scaled = (resized - low) / (high - low) if high > low else np.zeros_like(resized)
+    imsave(output_path, INFERNO_LUT[np.round(scaled * 255).astype(np.uint8)])
+
+
+def save_spectrograms(clips, frame_size=2048, hop_size=512, batched=False, image_mode="raster",
+                      image_size=IMAGE_SIZE, dataset=None, feature_mode=None, manifest=None):
+    """
+    Compute and save the spectrogram images of a group of clips.
+    Args:
+        clips (list): List of Clip tuples.
+        frame_size (int): Frame size for STFT.
+        hop_size (int): Hop size for STFT.
+        batched (bool): Whether to compute the STFTs with compute_spectrograms_batched.
+        image_mode (str): "raster" to write fixed-size images directly, "plot" to draw each one
+                          with a matplotlib figure for visual inspection, or None to skip images.
+        image_size (tuple): Output (height, width) of raster images and dataset entries in pixels.
+        dataset (SpectrogramDatasetWriter): If given, also append each resized dB spectrogram to it.
+        feature_mode (str): "mel" to also save each clip's log-mel spectrogram and MFCCs from
+                            compute_features to a "_features.npz" file next to its image, or None.
+        manifest (DatasetManifestWriter): If given, also add a row for each clip, and its resized dB
+                                          spectrogram to the manifest's shards if it writes any.
+    """
+    # The full-resolution STFT is only needed for images, the dataset and the shards
+    shards = manifest is not None and manifest.shards is not None
+    needs_spectrogram = image_mode is not None or dataset is not None or shards
+    spectrograms = None
+    if batched and needs_spectrogram:
+        try:
+            with track("stft_batch", f"{len(clips)} clips") as item, item.phase("stft"):
+                spectrograms = compute_spectrograms_batched([clip.signal for clip in clips], frame_size, hop_size)
+        except Exception as e:
+            print(f"Batched STFT failed, computing clips one by one: {e}")
+
+    for i, clip in enumerate(clips):
+        try:
+            with track("spectrogram", clip.name) as item:
+                if feature_mode == "mel":
+                    with item.phase("features"):
+                        output_path = features_path(clip.output_path)
+                        save_features(*compute_features(clip.signal, clip.sr), output_path)
+                    item.add_bytes(written=file_size(output_path))
+                    print(f"Features saved: {output_path}")
+                if not needs_spectrogram:
+                    if manifest is not None:
+                        manifest.add(clip, output_path if feature_mode == "mel" else None,
+                                     (N_MELS, FEATURE_FRAMES) if feature_mode == "mel" else None)
+                    continue
+                if spectrograms is not None:
+                    Y_log_scale = spectrograms[i]
+                else:
+                    with item.phase("stft"):
+                        Y_log_scale = compute_spectrogram(clip.signal, frame_size, hop_size)
+                if image_mode == "plot":
+                    with item.phase("savefig"):
+                        save_spectrogram_plot(Y_log_scale, clip.sr, clip.output_path, frame_size, hop_size)
+                    item.add_bytes(written=file_size(clip.output_path))
+                    print(f"Spectrogram saved: {clip.output_path}")
+                elif image_mode == "raster":
+                    with item.phase("render"):
+                        save_spectrogram_image(Y_log_scale, clip.output_path, image_size)
+                    item.add_bytes(written=file_size(clip.output_path))
+                    print(f"Spectrogram saved: {clip.output_path}")
+                resized = None
+                if dataset is not None or shards:
+                    resized = resize_linear(Y_log_scale[::-1], image_size)
+                if dataset is not None:
+                    with item.phase("dataset"):
+                        dataset.add(resized, clip.name, clip.label, clip.source)
+                if manifest is not None:
+                    with item.phase("manifest"):
+                        # Plotted figures have no fixed size
+                        shape = image_size if image_mode == "raster" or shards else None
+                        manifest.add(clip, clip.output_path if image_mode is not None else None, shape, resized)
+        except Exception as e:
+            print(f"Error processing {clip.name}: {e}")
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+TABLE_COLUMNS = ["File", "label", "start", "end", "row", "column"]
+
+
+def parse_timestamps(data):
+    """
+    Parse every "start:end" cell of a wide timestamp table in one vectorized pass.
+    Args:
+        data (pd.DataFrame): Timestamp table with a 'File' column followed by one column per label,
+                             whose cells hold "start:end" ranges in seconds.
+    Returns:
+        tuple: A long-format pd.DataFrame with "File", "label", "start", "end", "row" and "column"
+               columns, in row-major order of the cells, and a list of error dicts ("file", "label",
+               "row", "value") for the cells that are not two numbers separated by a colon.
+    """
+    labels = np.array(data.columns[1:], dtype=object)
+    cells = data[labels].to_numpy(dtype=object)
+
+    # Positions of the filled cells, row by row
+    rows, columns = np.nonzero(pd.notna(cells))
+    values = pd.Series(cells[rows, columns], dtype=object).astype(str)
+
+    # Split each cell into its start and end
+    parts = values.str.split(":", n=1, expand=True).reindex(columns=[0, 1])
+    start = pd.to_numeric(parts[0].astype(str).str.strip(), errors="coerce").to_numpy(dtype=np.float64)
+    end = pd.to_numeric(parts[1].astype(str).str.strip(), errors="coerce").to_numpy(dtype=np.float64)
+    valid = ~np.isnan(start) & ~np.isnan(end)
+
+    files = data["File"].astype(str).to_numpy(dtype=object)[rows]
+    table = pd.DataFrame({
+        "File": files[valid],
+        "label": labels[columns[valid]].astype(str),
+        "start": start[valid],
+        "end": end[valid],
+        "row": rows[valid],
+        "column": columns[valid],
+    }, columns=TABLE_COLUMNS)
+
+    invalid = np.flatnonzero(~valid)
+    errors = [
+        {"file": files[i], "label": str(labels[columns[i]]), "row": int(rows[i]), "value": values.iloc[i]}
+        for i in invalid
+    ]
+    return table, errors
+
+
+def load_timestamps(timestamps_csv):
+    """
+    Load a timestamps.csv file into a long-format table.
+    Args:
+        timestamps_csv (str): Path to the CSV file with filenames and timestamp ranges.
+    Returns:
+        tuple: The table and the list of invalid cells from parse_timestamps.
+    Raises:
+        ValueError: If the CSV file has no 'File' column.
+    """
+    data = pd.read_csv(timestamps_csv)
+    if 'File' not in data.columns:
+        raise ValueError("The CSV file must contain a 'File' column.")
+    return parse_timestamps(data)
+
+
+def index_timestamps(table, order="row"):
+    """
+    Group the timestamp table by file.
+    Args:
+        table (pd.DataFrame): Table from parse_timestamps.
+        order (str): "row" to list each file's ranges row by row, or "column" to list them
+                     column by column (the order process_all_files numbers segments in).
+    Returns:
+        dict: Maps each file to a list of (label, start, end) tuples.
+    """
+    if order == "column":
+        table = table.sort_values(["column", "row"], kind="stable")
+    index = {}
+    for file, group in table.groupby("File", sort=False):
+        index[file] = list(zip(group["label"].tolist(), group["start"].tolist(), group["end"].tolist()))
+    return index
@@ -1,19 +1,55 @@
 % Define the path to the spectrogram dataset
 digitDatasetPath = "/MATLAB Drive/Matlab_Audio_Spectrograms";
 
-% Load the dataset with imageDatastore
-digitData = imageDatastore(digitDatasetPath, ...
-    'IncludeSubfolders', true, ...
-    'LabelSource', 'foldernames');
-
-% Display data properties for verification
-disp("Loaded file paths:");
-disp(digitData.Files);
-disp("Loaded class labels:");
-disp(digitData.Labels);
-
-% Split the dataset into training, validation, and testing sets
-[trainDigitData, validDigitData, testDigitData] = splitEachLabel(digitData, 0.7, 0.1, "randomized");
+% Manifest written by the Python spectrogram generators, listing every image with its label and split
+manifestPath = fullfile(digitDatasetPath, "manifest.csv");
+
+useManifest = false;
+if isfile(manifestPath)
+    % Build the datastores from the manifest instead of scanning the folders. Its splits keep all
+    % clips of a recording together and are the same on every run. Only the spectrogram images are
+    % used; a feature-only manifest lists .npz files instead.
+    manifest = readtable(manifestPath, 'TextType', 'string', 'Delimiter', ',');
+    manifest = manifest(~ismissing(manifest.path) & endsWith(manifest.path, ".png"), :);
+    useManifest = height(manifest) > 0;
+end
+
+if useManifest
+    files = fullfile(digitDatasetPath, manifest.path);
+    labels = categorical(manifest.label);
+
+    trainRows = manifest.split == "train";
+    validRows = manifest.split == "val";
+    testRows = manifest.split == "test";
+    if any(trainRows) && any(validRows) && any(testRows)
+        trainDigitData = imageDatastore(files(trainRows), 'Labels', labels(trainRows));
+        validDigitData = imageDatastore(files(validRows), 'Labels', labels(validRows));
+        testDigitData = imageDatastore(files(testRows), 'Labels', labels(testRows));
+    else
+        % Too few recordings to fill every split; split each label's images instead
+        disp("A split of the manifest is empty; splitting each label randomly instead.");
+        digitData = imageDatastore(files, 'Labels', labels);
+        [trainDigitData, validDigitData, testDigitData] = splitEachLabel(digitData, 0.7, 0.1, "randomized");
+    end
+
+    % Display data properties for verification
+    disp("Loaded " + height(manifest) + " files from the manifest:");
+    disp(countcats(labels));
+else
+    % Load the dataset with imageDatastore
+    digitData = imageDatastore(digitDatasetPath, ...
+        'IncludeSubfolders', true, ...
+        'LabelSource', 'foldernames');
+
+    % Display data properties for verification
+    disp("Loaded file paths:");
+    disp(digitData.Files);
+    disp("Loaded class labels:");
+    disp(digitData.Labels);
+
+    % Split the dataset into training, validation, and testing sets
+    [trainDigitData, validDigitData, testDigitData] = splitEachLabel(digitData, 0.7, 0.1, "randomized");
+end
 
 % Load the pretrained AlexNet
 net = alexnet;
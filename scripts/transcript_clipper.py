@@ -1,90 +1,209 @@
 import os
 import json
-from moviepy.editor import VideoFileClip
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-
-# Set the directories
-transcripts_directory = "../output/transcripts/0531-new healthy"  # Directory containing your transcript JSON files
-media_directory = "../data/0531-new healthy"  # Directory containing your original video/audio files
-output_directory = "../output/clips"  # Directory where the clips will be saved
-os.makedirs(output_directory, exist_ok=True)
+import subprocess
+from audio_clip_splicer import load_audio, cut_clip
+from instrumentation import file_size, track
 
 # List of supported media file extensions
-supported_extensions = ('.mp4', '.mp3', '.wav', '.m4a')
-
-# Get a list of all transcript files
-transcript_files = [
-    f for f in os.listdir(transcripts_directory)
-    if f.lower().endswith('_transcript.json')
-]
-
-# Process each transcript file
-for transcript_file in transcript_files:
-    transcript_path = os.path.join(transcripts_directory, transcript_file)
-    media_filename = transcript_file.replace('_transcript.json', '')
-    
-    # Find the corresponding media file
-    media_file = None
+supported_extensions = ('.mp4', '.mp3', '.wav', '.m4a', '.flac')
+video_extensions = ('.mp4', '.mov', '.avi', '.mkv')
+audio_extensions = ('.mp3', '.wav', '.m4a', '.aac', '.flac')
+
+def find_media_file(media_directory, media_filename):
+    """
+    Find the media file that belongs to a transcript.
+    Args:
+        media_directory (str): Directory containing the original video/audio files.
+        media_filename (str): Base name of the media file.
+    Returns:
+        str: Path to the media file, or None if there is none.
+    """
     for ext in supported_extensions:
         possible_media_path = os.path.join(media_directory, media_filename + ext)
         if os.path.isfile(possible_media_path):
-            media_file = possible_media_path
-            break
-    
-    if media_file is None:
-        print(f"No corresponding media file found for {transcript_file}")
-        continue  # Skip to the next transcript if no media file is found
-    
-    print(f"Processing transcript: {transcript_path}")
-    print(f"Corresponding media file: {media_file}")
-    
-    # Load the transcript data
+            return possible_media_path
+    return None
+
+def words_sidecar_path(transcript_path):
+    """
+    Build the path of the JSONL file a chunked transcription appends its words to while it runs,
+    "<name>_transcript.words.jsonl" next to "<name>_transcript.json".
+    """
+    return f"{os.path.splitext(transcript_path)[0]}.words.jsonl"
+
+def load_words(transcript_path):
+    """
+    Load the word-level timestamps of a transcript.
+    While a chunked transcription is still running, its transcript is marked incomplete and
+    the words transcribed so far are read from its JSONL sidecar instead.
+    Args:
+        transcript_path (str): Path to the transcript JSON file.
+    Returns:
+        list: Word dicts with 'text', 'start' and 'end' keys.
+    """
     with open(transcript_path, 'r') as json_file:
         data = json.load(json_file)
-    
-    # Process each word in the transcript
-    words = []
+    sidecar_path = words_sidecar_path(transcript_path)
+    if data.get('complete') is False and os.path.exists(sidecar_path):
+        words = []
+        with open(sidecar_path, 'r') as words_file:
+            for line in words_file:
+                # The last line may still be being written
+                if not line.endswith("\n"):
+                    break
+                words.append(json.loads(line))
+        return words
+    return transcript_words(data)
+
+def transcript_words(data):
+    """
+    Extract the word-level timestamps of a transcription result.
+    Args:
+        data (dict): Result of whisper_timestamped.transcribe, or a loaded transcript.
+    Returns:
+        list: Word dicts with 'text', 'start' and 'end' keys.
+    """
     if 'words' in data:
         # For newer versions of whisper_timestamped that include 'words' at the top level
-        words = data['words']
-    else:
-        # For older versions, need to extract words from segments
-        for segment in data.get('segments', []):
-            words.extend(segment.get('words', []))
-    
-    for idx, word_info in enumerate(words):
-        word_text = word_info['text'].strip()
-        start_time = word_info['start']
-        end_time = word_info['end']
-        
-        # Construct a unique output filename
-        output_filename = f"{media_filename}_word_{idx}_{word_text.replace(' ', '_')}.mp4"  # Default to .mp4
-        output_path = os.path.join(output_directory, output_filename)
-        
+        return data['words']
+
+    # For older versions, need to extract words from segments
+    words = []
+    for segment in data.get('segments', []):
+        words.extend(segment.get('words', []))
+    return words
+
+def word_clip_path(output_directory, media_filename, idx, word_info, extension):
+    """
+    Build the output path of one word clip.
+    """
+    word_text = word_info['text'].strip()
+    return os.path.join(output_directory, f"{media_filename}_word_{idx}_{word_text.replace(' ', '_')}{extension}")
+
+def clip_audio_words(media_file, words, output_directory, media_filename):
+    """
+    Decode an audio file once and save a clip for every word.
+    Args:
+        media_file (str): Path to the audio file.
+        words (list): Word dicts with 'text', 'start' and 'end' keys.
+        output_directory (str): Directory where the clips will be saved.
+        media_filename (str): Base name used to name the clips.
+    """
+    with track("clip_audio_words", media_file) as item:
+        with item.phase("decode"):
+            audio = load_audio(media_file)
+        item.add_bytes(read=file_size(media_file))
+        for idx, word_info in enumerate(words):
+            output_path = word_clip_path(output_directory, media_filename, idx, word_info, ".mp3")
+            try:
+                with item.phase("encode"):
+                    cut_clip(audio, word_info['start'], word_info['end'], padding=0).export(output_path, format="mp3")
+                item.add_bytes(written=file_size(output_path))
+                print(f"Audio clip saved at {output_path}")
+            except Exception as e:
+                print(f"Error processing word '{word_info['text'].strip()}' in {media_file}: {e}")
+
+def clip_video_words(media_file, words, output_directory, media_filename, stream_copy=False, clips_per_command=50):
+    """
+    Save a clip for every word of a video file with one ffmpeg invocation per group of words.
+    By default the input is decoded once per group, from the group's first word to its last, and
+    every clip is cut from that decode and encoded with libx264/aac. With stream_copy, each clip is
+    copied without re-encoding from the keyframe at or before its start time, so clips may begin slightly early.
+    Args:
+        media_file (str): Path to the video file.
+        words (list): Word dicts with 'text', 'start' and 'end' keys.
+        output_directory (str): Directory where the clips will be saved.
+        media_filename (str): Base name used to name the clips.
+        stream_copy (bool): Copy the streams at keyframe boundaries instead of re-encoding.
+        clips_per_command (int): Maximum number of clips written by a single ffmpeg invocation.
+    """
+    clips = [
+        (word_info['start'], word_info['end'], word_clip_path(output_directory, media_filename, idx, word_info, ".mp4"))
+        for idx, word_info in enumerate(words)
+    ]
+    for first in range(0, len(clips), clips_per_command):
+        group = clips[first:first + clips_per_command]
+        command = ['ffmpeg', '-y', '-loglevel', 'error']
+        if stream_copy:
+            # Open the input once per clip; demuxing is cheap and nothing is decoded
+            for start_time, end_time, _ in group:
+                command += ['-ss', f"{start_time:.3f}", '-t', f"{end_time - start_time:.3f}", '-i', media_file]
+            for input_index, (_, _, output_path) in enumerate(group):
+                command += ['-map', f"{input_index}:v?", '-map', f"{input_index}:a?", '-c', 'copy',
+                            '-avoid_negative_ts', 'make_zero', output_path]
+        else:
+            # Seek to the group and decode only its span once, then cut every clip of the group from it;
+            # after an input-side seek, the output times are relative to the start of the group
+            group_start = min(start_time for start_time, _, _ in group)
+            group_end = max(end_time for _, end_time, _ in group)
+            command += ['-ss', f"{group_start:.3f}", '-t', f"{group_end - group_start:.3f}", '-i', media_file]
+            for start_time, end_time, output_path in group:
+                command += ['-map', '0:v?', '-map', '0:a?', '-ss', f"{start_time - group_start:.3f}",
+                            '-t', f"{end_time - start_time:.3f}", '-c:v', 'libx264', '-c:a', 'aac', output_path]
+
+        with track("clip_video_words", f"{media_file} [{first}:{first + len(group)}]") as item:
+            with item.phase("ffmpeg"):
+                result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"Error processing words {first}-{first + len(group) - 1} in {media_file}: "
+                      f"{result.stderr.strip()}")
+                continue
+            for _, _, output_path in group:
+                item.add_bytes(written=file_size(output_path))
+                print(f"Video clip saved at {output_path}")
+
+def clip_transcripts(transcripts_directory, media_directory, output_directory, stream_copy=False):
+    """
+    Save a clip for every word of every transcript in a directory.
+    Args:
+        transcripts_directory (str): Directory containing transcript JSON files.
+        media_directory (str): Directory containing the original video/audio files.
+        output_directory (str): Directory where the clips will be saved.
+        stream_copy (bool): For video files, copy the streams at keyframe boundaries instead of re-encoding.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+
+    # Get a list of all transcript files
+    transcript_files = [
+        f for f in os.listdir(transcripts_directory)
+        if f.lower().endswith('_transcript.json')
+    ]
+
+    # Process each transcript file
+    for transcript_file in transcript_files:
+        transcript_path = os.path.join(transcripts_directory, transcript_file)
+        media_filename = transcript_file.replace('_transcript.json', '')
+
+        # Find the corresponding media file
+        media_file = find_media_file(media_directory, media_filename)
+        if media_file is None:
+            print(f"No corresponding media file found for {transcript_file}")
+            continue  # Skip to the next transcript if no media file is found
+
+        print(f"Processing transcript: {transcript_path}")
+        print(f"Corresponding media file: {media_file}")
+
+        # Load the transcript data
+        words = load_words(transcript_path)
+
         try:
-            if media_file.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
+            if media_file.lower().endswith(video_extensions):
                 # For video files
-                video = VideoFileClip(media_file)
-                video_clip = video.subclip(start_time, end_time)
-                video_clip.write_videofile(output_path, codec='libx264', audio_codec='aac')
-                print(f"Video clip saved at {output_path}")
-                video_clip.close()
-                video.close()
-            elif media_file.lower().endswith(('.mp3', '.wav', '.m4a', '.aac', '.flac')):
+                clip_video_words(media_file, words, output_directory, media_filename, stream_copy)
+            elif media_file.lower().endswith(audio_extensions):
                 # For audio files
-                audio = AudioFileClip(media_file)
-                audio_clip = audio.subclip(start_time, end_time)
-                # Change the output extension to .mp3
-                output_filename = f"{media_filename}_word_{idx}_{word_text.replace(' ', '_')}.mp3"
-                output_path = os.path.join(output_directory, output_filename)
-                audio_clip.write_audiofile(output_path)
-                print(f"Audio clip saved at {output_path}")
-                audio_clip.close()
-                audio.close()
+                clip_audio_words(media_file, words, output_directory, media_filename)
             else:
                 print(f"Unsupported media file format: {media_file}")
         except Exception as e:
-            print(f"Error processing word '{word_text}' in {media_file}: {e}")
-            continue  # Skip to the next word
+            print(f"Error processing {media_file}: {e}")
+
+    print("All clips generated successfully!")
+
+if __name__ == "__main__":
+    # Set the directories
+    transcripts_directory = "../output/transcripts/0531-new healthy"  # Directory containing your transcript JSON files
+    media_directory = "../data/0531-new healthy"  # Directory containing your original video/audio files
+    output_directory = "../output/clips"  # Directory where the clips will be saved
 
-print("All clips generated successfully!")
+    clip_transcripts(transcripts_directory, media_directory, output_directory)
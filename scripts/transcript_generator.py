@@ -1,6 +1,13 @@
 import os
 import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+import numpy as np
 import whisper_timestamped as whisper
+from audio_cache import iter_pcm_windows, load_whisper_audio
+from instrumentation import file_size, track
+from transcript_clipper import transcript_words, words_sidecar_path
 
 # Function to adjust start and end times (optional, kept for consistency)
 def adjust_start_time(start_time):
@@ -9,45 +16,302 @@ def adjust_start_time(start_time):
 def adjust_end_time(end_time):
     return int(end_time) + 0.75
 
-# Specify the input directory containing your videos
-input_directory = "../data/0531-new healthy"
+# List of supported video/audio file extensions
+supported_extensions = ('.mp4', '.mp3', '.wav', '.m4a', '.flac')
 
-# Specify the output directory for the transcripts
-output_directory = "../output/transcripts/0531-new healthy"
-os.makedirs(output_directory, exist_ok=True)
+# Whisper model loaded once per process by load_worker_model
+model = None
 
-# List of supported video/audio file extensions
-supported_extensions = ('.mp4', '.mp3', '.wav', '.m4a')
-
-# Get a list of all video/audio files in the input directory
-video_files = [
-    f for f in os.listdir(input_directory)
-    if f.lower().endswith(supported_extensions)
-]
-
-# Load the Whisper model once before processing
-model = whisper.load_model("tiny", device="cpu")
-
-# Process each video file
-for video_file in video_files:
-    input_path = os.path.join(input_directory, video_file)
-    print(f"Processing {input_path}")
-    
+# Sampling rate Whisper expects its audio in
+WHISPER_SAMPLE_RATE = 16000
+
+def file_sha256(path):
+    """
+    Compute the SHA-256 hash of a file's content.
+    Args:
+        path (str): Path to the file.
+    Returns:
+        str: Hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def transcript_is_current(input_path, transcript_path):
+    """
+    Check whether a transcript is up to date with its source file.
+    A transcript is current if it is complete and either newer than the source, or
+    generated from a source whose hash matches the source's current content.
+    Args:
+        input_path (str): Path to the source video/audio file.
+        transcript_path (str): Path to the transcript JSON file.
+    Returns:
+        bool: True if the source does not need to be transcribed again.
+    """
+    if not os.path.exists(transcript_path):
+        return False
     try:
-        # Load the audio from the video file
-        audio = whisper.load_audio(input_path)
-        
+        with open(transcript_path, 'r') as json_file:
+            transcript = json.load(json_file)
+    except (OSError, ValueError):
+        return False
+    # A chunked transcription that was interrupted is never current
+    if transcript.get('complete') is False:
+        return False
+    if os.path.getmtime(transcript_path) >= os.path.getmtime(input_path):
+        return True
+    source_hash = transcript.get('source_sha256')
+    if source_hash is None or source_hash != file_sha256(input_path):
+        return False
+    # Mark the transcript as newer than the source so the next run can skip hashing
+    os.utime(transcript_path)
+    return True
+
+def write_json_atomic(data, output_path):
+    """
+    Write JSON to a temporary file and rename it over the output, so readers never see a partial file.
+    Args:
+        data (dict): Data to save.
+        output_path (str): Path to the JSON file.
+    """
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'w') as json_file:
+            json.dump(data, json_file, indent=2, ensure_ascii=False)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def load_worker_model(model_name="tiny", device="cpu", torch_threads=None):
+    """
+    Load the Whisper model into this process and limit its torch thread count.
+    Used as the initializer of each worker process.
+    Args:
+        model_name (str): Name of the Whisper model.
+        device (str): Device to run the model on.
+        torch_threads (int): Number of torch threads for this process, or None to keep the default.
+    """
+    global model
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    model = whisper.load_model(model_name, device=device)
+
+def transcribe_file(input_path, output_path):
+    """
+    Transcribe one video/audio file with the loaded model and save the transcript.
+    Args:
+        input_path (str): Path to the source video/audio file.
+        output_path (str): Path to save the transcript JSON file.
+    """
+    with track("transcribe", input_path) as item:
+        # Load the audio from the video file, or from the decoded-audio cache
+        with item.phase("load_audio"):
+            audio = load_whisper_audio(input_path)
+        item.add_bytes(read=file_size(input_path))
+
         # Transcribe the audio
-        result = whisper.transcribe(model, audio, language="en")
-        
+        with item.phase("transcribe"):
+            result = whisper.transcribe(model, audio, language="en")
+        with item.phase("hash"):
+            result['source_sha256'] = file_sha256(input_path)
+
         # Save the transcript to a JSON file
+        with item.phase("write"):
+            write_json_atomic(result, output_path)
+        item.add_bytes(written=file_size(output_path))
+
+def transcribe_window(audio, offset):
+    """
+    Transcribe one window of a recording with the loaded model.
+    Args:
+        audio (np.ndarray): Mono float32 signal of the window at WHISPER_SAMPLE_RATE.
+        offset (float): Start time of the window in the recording in seconds.
+    Returns:
+        list: Word dicts with their 'start' and 'end' shifted to recording time.
+    """
+    result = whisper.transcribe(model, audio, language="en")
+    return [dict(word, start=word['start'] + offset, end=word['end'] + offset) for word in transcript_words(result)]
+
+def transcribe_file_chunked(input_path, output_path, chunk_seconds=30.0, overlap_seconds=5.0, executor=None,
+                            max_pending=2):
+    """
+    Transcribe a long video/audio file in overlapping windows and save the transcript as the windows finish.
+    The audio is decoded window by window, so memory does not grow with the length of the recording.
+    Each window owns the part of the recording between the middles of its overlaps with its neighbours,
+    and keeps only the words whose midpoint falls in that part, so a word spoken in an overlap is
+    kept exactly once and from the window where it is furthest from the edge. Until the last window,
+    the transcript only holds "complete": false, and the words of every window are appended as they
+    are merged to a "<name>_transcript.words.jsonl" sidecar that load_words reads, so word clipping can
+    start before the whole file is transcribed. The full transcript is written once at the end and the
+    sidecar removed.
+    Args:
+        input_path (str): Path to the source video/audio file.
+        output_path (str): Path to save the transcript JSON file, with top-level 'words'.
+        chunk_seconds (float): Length of each window in seconds.
+        overlap_seconds (float): Overlap between consecutive windows in seconds.
+        executor (concurrent.futures.Executor): Pool whose workers have loaded the model with
+                                                load_worker_model, or None to use this process's model.
+        max_pending (int): Largest number of windows decoded and waiting for a worker.
+    """
+    window_samples = int(chunk_seconds * WHISPER_SAMPLE_RATE)
+    hop_samples = window_samples - int(overlap_seconds * WHISPER_SAMPLE_RATE)
+    if hop_samples <= 0:
+        raise ValueError("overlap_seconds must be shorter than chunk_seconds")
+    half_overlap = (window_samples - hop_samples) / 2 / WHISPER_SAMPLE_RATE
+
+    sidecar_path = words_sidecar_path(output_path)
+    with track("transcribe_chunked", input_path) as item:
+        item.add_bytes(read=file_size(input_path))
+        transcript = {"text": "", "words": [], "language": "en", "windows": 0, "complete": False}
+        with item.phase("write"):
+            # Mark the transcript incomplete first, so an interrupted run is never taken as current
+            write_json_atomic(transcript, output_path)
+        windows = iter_pcm_windows(input_path, WHISPER_SAMPLE_RATE, window_samples, hop_samples)
+        futures = {}
+        offsets = {}
+        decoded = 0
+        merged = 0
+        end_of_audio = False
+
+        with open(sidecar_path, 'w') as words_file:
+            while True:
+                # Keep the pool busy, and decode one window ahead to know whether the next one to merge
+                # is the last
+                with item.phase("decode"):
+                    while not end_of_audio and (len(futures) < max_pending or decoded <= merged + 1):
+                        try:
+                            first, pcm = next(windows)
+                        except StopIteration:
+                            end_of_audio = True
+                            break
+                        audio = pcm.astype(np.float32) / 32768.0
+                        offsets[decoded] = first / WHISPER_SAMPLE_RATE
+                        if executor is not None:
+                            futures[decoded] = executor.submit(transcribe_window, audio, offsets[decoded])
+                        else:
+                            # Transcribed when merged, so the model's time is not counted as decoding
+                            futures[decoded] = partial(transcribe_window, audio, offsets[decoded])
+                        decoded += 1
+                if merged == decoded:
+                    break
+
+                # Merge the windows in order, keeping the words each one owns
+                with item.phase("transcribe"):
+                    pending = futures.pop(merged)
+                    words = pending.result() if executor is not None else pending()
+                offset = offsets.pop(merged)
+                own_start = offset + half_overlap if merged else -np.inf
+                last = end_of_audio and merged == decoded - 1
+                own_end = offset + chunk_seconds - half_overlap if not last else np.inf
+                words = [word for word in words if own_start <= (word['start'] + word['end']) / 2 < own_end]
+                merged += 1
+
+                with item.phase("write"):
+                    transcript["words"].extend(words)
+                    words_file.writelines(json.dumps(word, ensure_ascii=False) + "\n" for word in words)
+                    words_file.flush()
+
+        with item.phase("hash"):
+            transcript['source_sha256'] = file_sha256(input_path)
+        transcript["text"] = " ".join(word['text'].strip() for word in transcript["words"])
+        transcript["windows"] = merged
+        transcript["complete"] = True
+        with item.phase("write"):
+            write_json_atomic(transcript, output_path)
+            os.remove(sidecar_path)
+        item.add_bytes(written=file_size(output_path))
+
+def generate_transcripts(input_directory, output_directory, workers=1, model_name="tiny", device="cpu", force=False,
+                         chunk_seconds=None, overlap_seconds=5.0):
+    """
+    Transcribe every video/audio file in a directory, skipping files whose transcript is up to date.
+    Args:
+        input_directory (str): Directory containing video/audio files.
+        output_directory (str): Directory to save transcript JSON files.
+        workers (int): Number of worker processes, each with its own copy of the model.
+        model_name (str): Name of the Whisper model.
+        device (str): Device to run the model on.
+        force (bool): Transcribe every file even if its transcript is up to date.
+        chunk_seconds (float): If set, transcribe each file in overlapping windows of this many seconds
+                               with transcribe_file_chunked, spreading the windows of one file across
+                               the workers instead of giving each worker a whole file.
+        overlap_seconds (float): Overlap between consecutive windows in seconds.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+
+    # Collect the video/audio files that need a new transcript
+    jobs = []
+    for video_file in sorted(os.listdir(input_directory)):
+        if not video_file.lower().endswith(supported_extensions):
+            continue
+        input_path = os.path.join(input_directory, video_file)
         transcript_filename = f"{os.path.splitext(video_file)[0]}_transcript.json"
         transcript_output_path = os.path.join(output_directory, transcript_filename)
-        with open(transcript_output_path, 'w') as json_file:
-            json.dump(result, json_file, indent=2, ensure_ascii=False)
-        
-        print(f"Transcript saved at {transcript_output_path}")
-    except Exception as e:
-        print(f"An error occurred while processing {video_file}: {e}")
-
-print("All transcripts generated successfully!")
\ No newline at end of file
+        if not force and transcript_is_current(input_path, transcript_output_path):
+            print(f"Transcript up to date, skipping {input_path}")
+            continue
+        jobs.append((input_path, transcript_output_path))
+
+    if not jobs:
+        print("All transcripts are up to date.")
+        return
+
+    # Split the CPU cores between the workers; in chunked mode even a single file keeps them all busy
+    workers = max(1, workers if chunk_seconds else min(workers, len(jobs)))
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    if chunk_seconds:
+        executor = None
+        if workers == 1:
+            load_worker_model(model_name, device, torch_threads)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=load_worker_model,
+                                           initargs=(model_name, device, torch_threads))
+        try:
+            for input_path, transcript_output_path in jobs:
+                print(f"Processing {input_path}")
+                try:
+                    transcribe_file_chunked(input_path, transcript_output_path, chunk_seconds, overlap_seconds,
+                                            executor, max_pending=2 * workers)
+                    print(f"Transcript saved at {transcript_output_path}")
+                except Exception as e:
+                    print(f"An error occurred while processing {input_path}: {e}")
+        finally:
+            if executor is not None:
+                executor.shutdown()
+    elif workers == 1:
+        load_worker_model(model_name, device, torch_threads)
+        for input_path, transcript_output_path in jobs:
+            print(f"Processing {input_path}")
+            try:
+                transcribe_file(input_path, transcript_output_path)
+                print(f"Transcript saved at {transcript_output_path}")
+            except Exception as e:
+                print(f"An error occurred while processing {input_path}: {e}")
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=load_worker_model,
+                                 initargs=(model_name, device, torch_threads)) as executor:
+            futures = {executor.submit(transcribe_file, *job): job for job in jobs}
+            for future in as_completed(futures):
+                input_path, transcript_output_path = futures[future]
+                try:
+                    future.result()
+                    print(f"Transcript saved at {transcript_output_path}")
+                except Exception as e:
+                    print(f"An error occurred while processing {input_path}: {e}")
+
+    print("All transcripts generated successfully!")
+
+if __name__ == "__main__":
+    # Specify the input directory containing your videos
+    input_directory = "../data/0531-new healthy"
+
+    # Specify the output directory for the transcripts
+    output_directory = "../output/transcripts/0531-new healthy"
+
+    # Transcribe with one worker per two cores
+    generate_transcripts(input_directory, output_directory, workers=max(1, (os.cpu_count() or 1) // 2))